@@ -16,4 +16,8 @@ class AnalyzerError(CustomException):
 
 # GitLab exceptions
 class GitLabAPIError(CustomException):
-    pass
\ No newline at end of file
+    pass
+
+# Background job exceptions
+class JobQueueFullError(CustomException):
+    pass
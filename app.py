@@ -7,6 +7,17 @@ from github_release_analyzer import generate_release_note
 from gitlab_analyzer import analyze_gitlab_commit
 from gitlab_release_analyzer import fetch_gitlab_release_data, generate_gitlab_release_note 
 from CustomException import *
+from jobs import ASYNC_WEBHOOKS, get_job, record_job_output, submit_job
+from async_runtime import run_coroutine
+from summary_cache import get_summary_cache_stats
+from project_context import get_project_context_cache_stats
+from release_index import (
+    forget_release,
+    get_release_index_stats,
+    github_repo_key,
+    gitlab_project_key,
+    record_release,
+)
 import asyncio
 import os
 import certifi
@@ -18,6 +29,39 @@ load_dotenv()
 
 app = Flask(__name__)
 
+# Maximum number of commits from one push analyzed at the same time
+COMMIT_CONCURRENCY = max(1, int(os.getenv("COMMIT_CONCURRENCY", "4")))
+
+
+def wants_async():
+    """Async mode is opt-in: ASYNC_WEBHOOKS=true, overridable per request with ?async=true|false"""
+    flag = request.args.get('async')
+    if flag is None:
+        return ASYNC_WEBHOOKS
+    return flag.lower() in ('1', 'true', 'yes')
+
+
+def respond(kind, process, *args, **kwargs):
+    """Run process(*args, **kwargs) now, or queue it and answer 202 with a job id"""
+    if not wants_async():
+        body, status_code = process(*args, **kwargs)
+        return jsonify(body), status_code
+
+    try:
+        job_id = submit_job(kind, process, *args, **kwargs)
+    except JobQueueFullError as e:
+        return jsonify({
+            'message': str(e),
+            'error_type': 'queue_full'
+        }), 503, {'Retry-After': '30'}
+
+    return jsonify({
+        'message': 'Webhook accepted for processing',
+        'job_id': job_id,
+        'status_url': f'/jobs/{job_id}'
+    }), 202
+
+
 @app.route('/gitlab-commit', methods=['POST'])
 def gitlab_commit():
     """Handle GitLab webhook data"""
@@ -48,10 +92,18 @@ def gitlab_commit():
         }), 400
 
     print(f"Received a GitLab push event for {project_id}/{project_name}")
-    
+
+    return respond(
+        'gitlab-commit', process_gitlab_commit,
+        project_id, project_name, commit_sha, branch_name, author, commit_message, commit_timestamp
+    )
+
+
+def process_gitlab_commit(project_id, project_name, commit_sha, branch_name, author, commit_message, commit_timestamp):
+    """Analyze one GitLab commit and return the response body and status code"""
     try:
         # Analyze the commit using GitLab analyzer
-        result = asyncio.run(analyze_gitlab_commit(
+        result = run_coroutine(analyze_gitlab_commit(
             project_id, 
             project_name, 
             commit_sha, 
@@ -62,50 +114,51 @@ def gitlab_commit():
         ))
         
         if result:
-            return jsonify({
+            record_job_output(result)
+            return {
                 "message": "GitLab webhook received and processed",
                 "commit": commit_sha,
                 "file_path": result,
                 "project_id": project_id,
                 "project_name": project_name
-            }), 200
+            }, 200
         else:
-            return jsonify({
+            return {
                 "message": "Failed to analyze GitLab commit",
                 "commit": commit_sha,
                 "project_id": project_id,
                 "project_name": project_name
-            }), 500
+            }, 500
     except CommitNotFoundError as e:
-        return jsonify({
+        return {
             "message": str(e),
             "commit": commit_sha,
             "error_type": "not_found"
-        }), 404
+        }, 404
     except GitLabAPIError as e:
-        return jsonify({
+        return {
             "message": str(e),
             "commit": commit_sha,
             "error_type": "gitlab_api"
-        }), 503
+        }, 503
     except GoogleCloudStorageError as e:
-        return jsonify({
+        return {
             "message": str(e),
             "commit": commit_sha,
             "error_type": "storage"
-        }), 500
+        }, 500
     except AnalyzerError as e:
-        return jsonify({
+        return {
             "message": str(e),
             "commit": commit_sha,
             "error_type": "analyzer"
-        }), 400
+        }, 400
     except Exception as e:
-        return jsonify({
+        return {
             "message": f"Unexpected error: {str(e)}",
             "commit": commit_sha,
             "error_type": "unknown"
-        }), 500
+        }, 500
 
 @app.route('/webhook', methods=['POST'])
 def github_webhook():
@@ -138,59 +191,116 @@ def github_webhook():
 
     print(f"Received a push event for {repo_owner}/{repo_name}")
 
+    return respond(
+        'github-push', process_github_push,
+        repo_owner, repo_name, branch_name, payload.get('commits', [])
+    )
+
+
+async def analyze_push_commit(repo_owner, repo_name, branch_name, commit):
+    """Analyze one pushed commit and return ("result", entry) or ("error", entry)"""
+    commit_sha = commit.get('id')
+    try:
+        # Analyzing the commit using the analyze_commit function, seeded with the payload's metadata
+        result = await analyze_commit(repo_owner, repo_name, commit_sha, branch_name, push_commit=commit)
+        
+        if result:
+            record_job_output(result)
+            return "result", {
+                "commit": commit_sha,
+                "file_path": result
+            }
+        return None
+    except CommitNotFoundError as e:
+        return "error", {
+            "commit": commit_sha,
+            "error": str(e),
+            "type": "not_found"
+        }
+    except GitHubAPIError as e:
+        return "error", {
+            "commit": commit_sha,
+            "error": str(e),
+            "type": "github_api"
+        }
+    except GoogleCloudStorageError as e:
+        return "error", {
+            "commit": commit_sha,
+            "error": str(e),
+            "type": "storage"
+        }
+    except AnalyzerError as e:
+        return "error", {
+            "commit": commit_sha,
+            "error": str(e),
+            "type": "analyzer"
+        }
+    except Exception as e:
+        return "error", {
+            "commit": commit_sha,
+            "error": f"Unexpected error: {str(e)}",
+            "type": "unknown"
+        }
+
+
+async def analyze_push_commits(repo_owner, repo_name, branch_name, commits):
+    """Analyze the commits of a push, returning outcomes in push order.
+
+    A commit waits for the earlier commits of the push that touched any of
+    its files, so their documentation is already in the file index when its
+    previous documentation is looked up. Commits touching unrelated files
+    run concurrently, at most COMMIT_CONCURRENCY at a time.
+    """
+    semaphore = asyncio.Semaphore(COMMIT_CONCURRENCY)
+    # Most recent task of this push that touched each file
+    last_touched = {}
+    tasks = []
+
+    async def analyze_one(commit, predecessors):
+        if predecessors:
+            # analyze_push_commit reports errors as outcomes, so this never raises
+            await asyncio.wait(predecessors)
+        async with semaphore:
+            return await analyze_push_commit(repo_owner, repo_name, branch_name, commit)
+
+    for commit in commits:
+        paths = set(commit.get('added', [])) | set(commit.get('modified', [])) | set(commit.get('removed', []))
+        predecessors = {last_touched[path] for path in paths if path in last_touched}
+        task = asyncio.ensure_future(analyze_one(commit, predecessors))
+        for path in paths:
+            last_touched[path] = task
+        tasks.append(task)
+
+    return await asyncio.gather(*tasks)
+
+
+def process_github_push(repo_owner, repo_name, branch_name, commits):
+    """Analyze every commit of a GitHub push and return the response body and status code"""
     # Process each commit in the payload
-    commits = payload.get('commits', [])
     results = []
     errors = []  # Track errors without stopping processing
 
+    pushed_commits = []
     for commit in commits:
-        try:
-            commit_sha = commit.get('id')
-            commit_message = commit.get('message', '')
+        commit_sha = commit.get('id')
+        commit_message = commit.get('message', '')
 
-            # Skipping the merge commits
-            if commit_message.startswith('Merge'):
-                print(f"Skipping merge commit {commit_sha}")
-                continue
+        # Skipping the merge commits
+        if commit_message.startswith('Merge'):
+            print(f"Skipping merge commit {commit_sha}")
+            continue
+        pushed_commits.append(commit)
 
-            # Analyzing the commit using the analyze_commit function
-            result = asyncio.run(analyze_commit(repo_owner, repo_name, commit_sha, branch_name))
-            
-            if result:
-                results.append({
-                    "commit": commit_sha,
-                    "file_path": result
-                })
-        except CommitNotFoundError as e:
-            errors.append({
-                "commit": commit_sha,
-                "error": str(e),
-                "type": "not_found"
-            })
-        except GitHubAPIError as e:
-            errors.append({
-                "commit": commit_sha,
-                "error": str(e),
-                "type": "github_api"
-            })
-        except GoogleCloudStorageError as e:
-            errors.append({
-                "commit": commit_sha,
-                "error": str(e),
-                "type": "storage"
-            })
-        except AnalyzerError as e:
-            errors.append({
-                "commit": commit_sha,
-                "error": str(e),
-                "type": "analyzer"
-            })
-        except Exception as e:
-            errors.append({
-                "commit": commit_sha,
-                "error": f"Unexpected error: {str(e)}",
-                "type": "unknown"
-            })
+    # Commits touching the same files are analyzed in push order, the rest concurrently
+    outcomes = run_coroutine(analyze_push_commits(repo_owner, repo_name, branch_name, pushed_commits))
+    for outcome in outcomes:
+        if outcome is None:
+            continue
+        kind, entry = outcome
+        if kind == "result":
+            results.append(entry)
+        else:
+            errors.append(entry)
     
     # Determine response status based on results
     if not results and errors:
@@ -202,22 +312,22 @@ def github_webhook():
         elif any(e["type"] == "analyzer" for e in errors):
             status_code = 400
             
-        return jsonify({
+        return {
             "message": "Webhook processing encountered errors",
             "errors": errors,
             "repo_owner": repo_owner,
             "repo_name": repo_name
-        }), status_code
+        }, status_code
     
     # Return both successes and errors
-    return jsonify({
+    return {
         "message": "Webhook received and processed",
         "commits_analyzed": len(results),
         "results": results,
         "errors": errors if errors else None,
         "repo_owner": repo_owner,
         "repo_name": repo_name
-    }), 200
+    }, 200
 
 
 @app.route('/gitlab-release', methods=['POST'])
@@ -237,114 +347,124 @@ def gitlab_release():
             }), 400
         
         # Extract optional fields provided by pipeline
-        project_name = payload.get('project_name')
-        project_path = payload.get('project_path')
-        commit_sha = payload.get('commit_sha')
-        commit_timestamp = payload.get('commit_timestamp')
-        commit_title = payload.get('commit_title')
-        pipeline_id = payload.get('pipeline_id')
-        pipeline_url = payload.get('pipeline_url')
-        default_branch = payload.get('default_branch')
-            
-        # Fetch additional release information from GitLab API
-        try:
-            gitlab_data = fetch_gitlab_release_data(
-                project_id, 
-                tag_name,
-                project_name=project_name,
-                project_path=project_path,
-                commit_sha=commit_sha,
-                commit_timestamp=commit_timestamp
-            )
-            
-            # Use provided project_name if available, otherwise use from API
-            project_name = project_name or gitlab_data.get('project_name')
-            release_name = gitlab_data.get('release_name', tag_name)
-            release_body = gitlab_data.get('description', commit_title or '')
-            created_at = gitlab_data.get('created_at', commit_timestamp)
-            
-            # Add pipeline context to the gitlab data
-            gitlab_data['pipeline_id'] = pipeline_id
-            gitlab_data['pipeline_url'] = pipeline_url
-            gitlab_data['default_branch'] = default_branch
-            
-        except GitLabAPIError as e:
-            # Fall back to pipeline data if API fails
-            if project_name:
-                # We can continue with minimal data if project_name is provided
-                release_name = tag_name
-                release_body = commit_title or ''
-                created_at = commit_timestamp
-                
-                print(f"Warning: Using pipeline data only due to API error: {str(e)}")
-            else:
-                return jsonify({
-                    'message': f'Error fetching release data from GitLab API: {str(e)}',
-                    'error_type': 'gitlab_api'
-                }), 503
-        
+        context_data = {
+            'project_name': payload.get('project_name'),
+            'project_path': payload.get('project_path'),
+            'commit_sha': payload.get('commit_sha'),
+            'commit_timestamp': payload.get('commit_timestamp'),
+            'commit_title': payload.get('commit_title'),
+            'pipeline_id': payload.get('pipeline_id'),
+            'pipeline_url': payload.get('pipeline_url'),
+            'default_branch': payload.get('default_branch')
+        }
     except Exception as e:
         return jsonify({
             'message': 'Invalid GitLab release payload',
             'error': str(e)
         }), 400
 
+    # The release details are fetched from GitLab by the job itself, so async
+    # mode answers without waiting on the GitLab API
+    return respond('gitlab-release', process_gitlab_release, project_id, tag_name, context_data)
+
+
+def process_gitlab_release(project_id, tag_name, context_data):
+    """Fetch a GitLab release, generate its note and return the response body and status code"""
+    project_name = context_data.get('project_name')
+    commit_title = context_data.get('commit_title')
+    commit_timestamp = context_data.get('commit_timestamp')
+
+    # Fetch additional release information from GitLab API
+    try:
+        gitlab_data = fetch_gitlab_release_data(
+            project_id, 
+            tag_name,
+            project_name=project_name,
+            project_path=context_data.get('project_path'),
+            commit_sha=context_data.get('commit_sha'),
+            commit_timestamp=commit_timestamp
+        )
+        
+        # Use provided project_name if available, otherwise use from API
+        project_name = project_name or gitlab_data.get('project_name')
+        release_name = gitlab_data.get('release_name', tag_name)
+        release_body = gitlab_data.get('description', commit_title or '')
+        created_at = gitlab_data.get('created_at', commit_timestamp)
+
+        # The index orders GitLab releases by released_at, as its backfill does; with
+        # only a fallback timestamp the next rebuild places the tag instead
+        if gitlab_data.get('released_at'):
+            record_release(gitlab_project_key(project_id), tag_name, gitlab_data['released_at'])
+        
+    except GitLabAPIError as e:
+        # Fall back to pipeline data if API fails
+        if not project_name:
+            return {
+                'message': f'Error fetching release data from GitLab API: {str(e)}',
+                'error_type': 'gitlab_api'
+            }, 503
+
+        # We can continue with minimal data if project_name is provided
+        release_name = tag_name
+        release_body = commit_title or ''
+        created_at = commit_timestamp
+        print(f"Warning: Using pipeline data only due to API error: {str(e)}")
+    except Exception as e:
+        return {
+            'message': f'Unexpected error fetching release data: {str(e)}',
+            'release': tag_name,
+            'error_type': 'unknown'
+        }, 500
+
     try:
         # Pass all context data to the release note generator
-        release_note_path = asyncio.run(generate_gitlab_release_note(
+        release_note_path = run_coroutine(generate_gitlab_release_note(
             project_id=project_id,
             project_name=project_name,
             release_tag=tag_name,
             release_name=release_name,
             release_body=release_body,
             created_at=created_at,
-            context_data={
-                'project_path': project_path,
-                'commit_sha': commit_sha,
-                'commit_timestamp': commit_timestamp,
-                'commit_title': commit_title,
-                'pipeline_id': pipeline_id,
-                'pipeline_url': pipeline_url,
-                'default_branch': default_branch
-            }
+            context_data=context_data
         ))
+        record_job_output(release_note_path)
 
-        return jsonify({
+        return {
             'message': 'GitLab release note generated successfully',
             'release': tag_name,
             'path': release_note_path,
             'project_name': project_name
-        }), 200
+        }, 200
     except CommitNotFoundError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': tag_name,
             'error_type': 'commit_not_found'
-        }), 404
+        }, 404
     except GitLabAPIError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': tag_name,
             'error_type': 'gitlab_api'
-        }), 503
+        }, 503
     except GoogleCloudStorageError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': tag_name,
             'error_type': 'storage'
-        }), 500
+        }, 500
     except AnalyzerError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': tag_name,
             'error_type': 'analyzer'
-        }), 400
+        }, 400
     except Exception as e:
-        return jsonify({
+        return {
             'message': f'Unexpected error: {str(e)}',
             'release': tag_name,
             'error_type': 'unknown'
-        }), 500
+        }, 500
 
 
 @app.route('/release-webhook', methods=['POST'])
@@ -370,51 +490,88 @@ def github_release_webhook():
             'error': f'Key {str(e)} not found in payload'
         }), 400
 
+    # Keep the release index in step so previous tags resolve without listing releases
+    if payload.get('action') in ('deleted', 'unpublished'):
+        forget_release(github_repo_key(repo_owner, repo_name), release_tag)
+        return jsonify({
+            'message': f'Release {release_tag} removed from the release index',
+            'release': release_tag
+        }), 200
+    record_release(github_repo_key(repo_owner, repo_name), release_tag, created_at)
+
+    return respond(
+        'github-release', process_github_release,
+        repo_owner, repo_name, release_tag, release_name, release_body, created_at
+    )
+
+
+def process_github_release(repo_owner, repo_name, release_tag, release_name, release_body, created_at):
+    """Generate a GitHub release note and return the response body and status code"""
     try:
-        release_note_path = asyncio.run(generate_release_note(
+        release_note_path = run_coroutine(generate_release_note(
             repo_owner, repo_name, release_tag, release_name, release_body, created_at
         ))
+        record_job_output(release_note_path)
 
-        return jsonify({
+        return {
             'message': 'Release note generated successfully',
             'release': release_tag,
             'path': release_note_path
-        }), 200
+        }, 200
     except CommitNotFoundError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': release_tag,
             'error_type': 'commit_not_found'
-        }), 404
+        }, 404
     except GitHubAPIError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': release_tag,
             'error_type': 'github_api'
-        }), 503  # Service Unavailable for API errors
+        }, 503  # Service Unavailable for API errors
     except GoogleCloudStorageError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': release_tag,
             'error_type': 'storage'
-        }), 500
+        }, 500
     except AnalyzerError as e:
-        return jsonify({
+        return {
             'message': str(e),
             'release': release_tag,
             'error_type': 'analyzer'
-        }), 400
+        }, 400
     except Exception as e:
-        return jsonify({
+        return {
             'message': f'Unexpected error: {str(e)}',
             'release': release_tag,
             'error_type': 'unknown'
-        }), 500
+        }, 500
 
 
 
 
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report the status, stage timings and outputs of an async webhook job"""
+    job = get_job(job_id)
+    if job is None:
+        return jsonify({'message': f'Job {job_id} not found'}), 404
+    return jsonify(job), 200
+
+
+@app.route('/cache-stats', methods=['GET'])
+def cache_stats():
+    """Report hit/miss counters of the summary, project context and release index caches"""
+    return jsonify({
+        'summaries': get_summary_cache_stats(),
+        'project_context': get_project_context_cache_stats(),
+        'release_index': get_release_index_stats(),
+    }), 200
+
+
 @app.route('/', methods=['GET'])
 def home():
     """Simple endpoint to verify the server is running"""
@@ -0,0 +1,36 @@
+# async_runtime.py
+"""
+Process-wide event loop for the analyzer pipelines.
+
+Webhook handlers and job workers are plain threads. Instead of starting a new
+loop with asyncio.run for every commit, they submit coroutines to one
+long-lived loop running in a daemon thread, so pooled async HTTP connections
+and in-flight requests are shared across webhooks.
+"""
+import asyncio
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Return the shared event loop, starting its thread on first use"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=loop.run_forever, name="async-runtime", daemon=True)
+                thread.start()
+                _loop = loop
+    return _loop
+
+
+def run_coroutine(coro):
+    """Run coro on the shared loop and block the calling thread until it finishes.
+
+    The coroutine runs in a copy of the caller's context, so job stage timings
+    recorded inside it still reach the caller's job.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result()
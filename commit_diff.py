@@ -0,0 +1,366 @@
+# commit_diff.py
+"""
+Structured commit diffs.
+
+A commit's diff is parsed once, line by line, into a CommitDiff of FileDiffs
+and Hunks. The same structure gives the unified diff text sent to the LLM,
+the changed-file list used to look up previous documentation, per-file
+added/removed line counts and the functions and classes a change touched, so
+filtering, chunking and token budgeting never go back to the raw string.
+
+DiffParser accepts one line at a time, so a diff can be parsed while it is
+still being downloaded.
+"""
+import re
+
+HUNK_HEADER = re.compile(r"^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@ ?(.*)$")
+# Mode written on new and deleted file lines
+DEFAULT_FILE_MODE = "100644"
+
+# Lines that open a definition in the common languages; matched against one
+# changed line at a time
+SIGNATURE = re.compile(
+    r"^\s*(?:export\s+|public\s+|private\s+|protected\s+|static\s+|abstract\s+|final\s+|async\s+)*"
+    r"(?:def|class|function|func|fn|interface|struct|enum|trait|module|impl)\s+[\w$.<>]+"
+)
+
+
+class Hunk:
+    """One @@ section of a file diff"""
+    __slots__ = ("old_start", "old_lines", "new_start", "new_lines", "section", "lines", "added", "removed")
+
+    def __init__(self, old_start, old_lines, new_start, new_lines, section=""):
+        self.old_start = old_start
+        self.old_lines = old_lines
+        self.new_start = new_start
+        self.new_lines = new_lines
+        # Enclosing function or class, as reported by git after the second @@
+        self.section = section
+        self.lines = []
+        self.added = 0
+        self.removed = 0
+
+    @classmethod
+    def from_header(cls, line):
+        match = HUNK_HEADER.match(line)
+        if not match:
+            return None
+        old_start, old_lines, new_start, new_lines, section = match.groups()
+        return cls(
+            int(old_start), int(old_lines) if old_lines is not None else 1,
+            int(new_start), int(new_lines) if new_lines is not None else 1,
+            section.strip(),
+        )
+
+    def add_line(self, line):
+        self.lines.append(line)
+        if line.startswith("+"):
+            self.added += 1
+        elif line.startswith("-"):
+            self.removed += 1
+
+    @property
+    def header(self):
+        section = f" {self.section}" if self.section else ""
+        return f"@@ -{self.old_start},{self.old_lines} +{self.new_start},{self.new_lines} @@{section}"
+
+    def signatures(self):
+        """Definitions added or removed inside this hunk"""
+        signatures = []
+        for line in self.lines:
+            if line[:1] in ("+", "-"):
+                match = SIGNATURE.match(line[1:])
+                if match:
+                    signatures.append(match.group(0).strip())
+        return signatures
+
+    def render(self):
+        return "\n".join((self.header, *self.lines)) + "\n"
+
+
+class FileDiff:
+    """Diff of a single file in a commit"""
+    __slots__ = ("old_path", "new_path", "new_file", "deleted_file", "renamed_file", "binary", "preamble", "hunks")
+
+    def __init__(self, old_path, new_path, patch="", new_file=False, deleted_file=False, renamed_file=False):
+        self.old_path = old_path
+        self.new_path = new_path
+        self.new_file = new_file
+        self.deleted_file = deleted_file
+        self.renamed_file = renamed_file
+        self.binary = False
+        # Lines before the first hunk, e.g. "Binary files differ" or a filter stub
+        self.preamble = []
+        self.hunks = []
+        for line in (patch or "").splitlines():
+            self.add_line(line)
+
+    def add_line(self, line):
+        """Add one line of the patch body (hunk headers and hunk lines)"""
+        if line.startswith("@@"):
+            hunk = Hunk.from_header(line)
+            if hunk is not None:
+                self.hunks.append(hunk)
+                return
+        if self.hunks:
+            self.hunks[-1].add_line(line)
+        else:
+            if line.startswith("Binary files") or line.startswith("GIT binary patch"):
+                self.binary = True
+            self.preamble.append(line)
+
+    @property
+    def path(self):
+        return self.new_path or self.old_path
+
+    @property
+    def added(self):
+        return sum(hunk.added for hunk in self.hunks)
+
+    @property
+    def removed(self):
+        return sum(hunk.removed for hunk in self.hunks)
+
+    @property
+    def line_count(self):
+        """Lines in the patch body, hunk headers included"""
+        return len(self.preamble) + sum(len(hunk.lines) + 1 for hunk in self.hunks)
+
+    def symbols(self):
+        """Functions and classes touched by the change, in order of first appearance"""
+        symbols = []
+        for hunk in self.hunks:
+            if hunk.section:
+                symbols.append(hunk.section)
+            symbols.extend(hunk.signatures())
+        return list(dict.fromkeys(symbols))
+
+    def top_lines(self, count):
+        """Lines of the new file among its first count lines that the diff shows.
+
+        Only context and added lines of hunks starting within those lines
+        count, without their +/space prefix; a hunk further down the file,
+        and a hunk's section text, never do.
+        """
+        lines = []
+        for hunk in self.hunks:
+            line_number = hunk.new_start
+            if line_number > count:
+                break
+            for line in hunk.lines:
+                if line.startswith("-") or line.startswith("\\"):
+                    continue
+                if line_number > count:
+                    break
+                lines.append(line[1:])
+                line_number += 1
+        return lines
+
+    @property
+    def patch(self):
+        body = "".join(hunk.render() for hunk in self.hunks)
+        if self.preamble:
+            body = "\n".join(self.preamble) + "\n" + body
+        return body
+
+    def header(self):
+        """git diff header, with the new, deleted and renamed file lines the flags call for"""
+        lines = [f"diff --git a/{self.old_path} b/{self.new_path}\n"]
+        # The file mode isn't kept, regular files are by far the most common
+        if self.new_file:
+            lines.append(f"new file mode {DEFAULT_FILE_MODE}\n")
+        elif self.deleted_file:
+            lines.append(f"deleted file mode {DEFAULT_FILE_MODE}\n")
+        if self.renamed_file:
+            lines.append(f"rename from {self.old_path}\n")
+            lines.append(f"rename to {self.new_path}\n")
+        lines.append("--- /dev/null\n" if self.new_file else f"--- a/{self.old_path}\n")
+        lines.append("+++ /dev/null\n" if self.deleted_file else f"+++ b/{self.new_path}\n")
+        return "".join(lines)
+
+    def render(self):
+        """Unified diff text of this file, in the format of a git diff"""
+        return "".join((self.header(), self.patch, "\n"))
+
+    def stub(self, reason):
+        """Copy of this file diff with its body replaced by a one-line note"""
+        stub = FileDiff(self.old_path, self.new_path, new_file=self.new_file,
+                        deleted_file=self.deleted_file, renamed_file=self.renamed_file)
+        stub.preamble = [f"[{reason}: +{self.added}/-{self.removed} lines, diff omitted]"]
+        return stub
+
+
+class DiffParser:
+    """Incremental parser for git unified diffs (GitHub's diff media type).
+
+    Feed lines as they arrive with feed() and get the CommitDiff from close().
+    """
+
+    def __init__(self):
+        self.files = []
+        self.current = None
+        self.in_body = False
+
+    def feed(self, line):
+        line = line.rstrip("\r\n")
+        if line.startswith("diff --git "):
+            # "diff --git a/<old> b/<new>"; refined below by the ---/+++ lines when present
+            old_path, _, new_path = line[len("diff --git a/"):].partition(" b/")
+            self.current = FileDiff(old_path, new_path)
+            self.files.append(self.current)
+            self.in_body = False
+            return
+
+        current = self.current
+        if current is None:
+            return
+
+        if not self.in_body and not line.startswith("@@"):
+            # Extended header lines before the first hunk
+            if line.startswith("new file mode"):
+                current.new_file = True
+            elif line.startswith("deleted file mode"):
+                current.deleted_file = True
+            elif line.startswith("rename from "):
+                current.renamed_file = True
+                current.old_path = line[len("rename from "):]
+            elif line.startswith("rename to "):
+                current.new_path = line[len("rename to "):]
+            elif line.startswith("--- a/"):
+                current.old_path = line[len("--- a/"):]
+            elif line.startswith("+++ b/"):
+                current.new_path = line[len("+++ b/"):]
+            elif line.startswith("Binary files") or line.startswith("GIT binary patch"):
+                current.add_line(line)
+            return
+
+        self.in_body = True
+        current.add_line(line)
+
+    def close(self):
+        return CommitDiff(self.files)
+
+
+class CommitDiff:
+    """All file diffs of a commit"""
+    __slots__ = ("files",)
+
+    def __init__(self, files=None):
+        self.files = list(files or [])
+
+    @classmethod
+    def from_gitlab(cls, entries):
+        """Build from the entries of GitLab's /repository/commits/:sha/diff endpoint"""
+        return cls(
+            FileDiff(
+                entry.get("old_path"),
+                entry.get("new_path"),
+                entry.get("diff", ""),
+                new_file=entry.get("new_file", False),
+                deleted_file=entry.get("deleted_file", False),
+                renamed_file=entry.get("renamed_file", False),
+            )
+            for entry in entries
+        )
+
+    @classmethod
+    def from_github(cls, files):
+        """Build from the ``files`` of a GitHub commit JSON response"""
+        return cls(
+            FileDiff(
+                file.get("previous_filename") or file.get("filename"),
+                file.get("filename"),
+                file.get("patch", ""),
+                new_file=file.get("status") == "added",
+                deleted_file=file.get("status") == "removed",
+                renamed_file=file.get("status") == "renamed",
+            )
+            for file in files
+        )
+
+    @classmethod
+    def from_unified(cls, text):
+        """Parse a git unified diff held in memory"""
+        parser = DiffParser()
+        for line in text.splitlines():
+            parser.feed(line)
+        return parser.close()
+
+    @property
+    def changed_files(self):
+        """Paths of the files changed by the commit"""
+        return [file_diff.path for file_diff in self.files if file_diff.path]
+
+    @property
+    def added(self):
+        return sum(file_diff.added for file_diff in self.files)
+
+    @property
+    def removed(self):
+        return sum(file_diff.removed for file_diff in self.files)
+
+    def summary(self):
+        """One line per file with its line counts and the symbols it touched"""
+        lines = []
+        for file_diff in self.files:
+            symbols = file_diff.symbols()
+            touched = f" ({', '.join(symbols[:5])})" if symbols else ""
+            lines.append(f"{file_diff.path}: +{file_diff.added}/-{file_diff.removed}{touched}")
+        return "\n".join(lines)
+
+    def render(self):
+        """Unified diff text of the whole commit"""
+        return "".join(file_diff.render() for file_diff in self.files)
+
+    def chunks(self, max_tokens, count_tokens):
+        """Split the rendered diff into pieces of at most about max_tokens.
+
+        Whole files are grouped together while they fit; a file that is too
+        big on its own is split between its hunks, and a single hunk that is
+        still too big becomes a piece of its own (to be trimmed by the caller).
+        """
+        chunks = []
+        current = []
+        current_tokens = 0
+
+        def flush():
+            nonlocal current, current_tokens
+            if current:
+                chunks.append("".join(current))
+            current = []
+            current_tokens = 0
+
+        for file_diff in self.files:
+            rendered = file_diff.render()
+            tokens = count_tokens(rendered)
+            if tokens <= max_tokens or len(file_diff.hunks) <= 1:
+                if current and current_tokens + tokens > max_tokens:
+                    flush()
+                current.append(rendered)
+                current_tokens += tokens
+                continue
+
+            flush()
+            header = file_diff.header()
+            header_tokens = count_tokens(header)
+            for hunk in file_diff.hunks:
+                rendered_hunk = hunk.render()
+                hunk_tokens = count_tokens(rendered_hunk)
+                if current and current_tokens + hunk_tokens > max_tokens:
+                    flush()
+                if not current:
+                    # Every piece of a split file repeats its header
+                    current.append(header)
+                    current_tokens = header_tokens
+                current.append(rendered_hunk)
+                current_tokens += hunk_tokens
+            flush()
+
+        flush()
+        return chunks
+
+    def __len__(self):
+        return len(self.files)
+
+    def __bool__(self):
+        return bool(self.files)
@@ -0,0 +1,250 @@
+# commit_index.py
+"""
+SHA-keyed index of commit documentation stored in GCS.
+
+Commit docs are written to a content-addressed path,
+``{repo_name}/by-sha/{sha[:2]}/{commit_sha}``, so a reader can fetch one with a
+single GET. Docs written under the older ``{branch}/commits/...`` layout are
+reached through marker objects at ``_index/commits/{repo_name}/{commit_sha}``
+whose metadata points at the blob holding the documentation; every write also
+updates the marker so bulk lookups can list one prefix per repo. The index can
+be rebuilt from the existing documentation blobs with:
+
+    python commit_index.py rebuild <bucket_name>
+
+and legacy blobs can be moved into the content-addressed layout with
+``migrate_commit_docs.py``.
+"""
+import os
+import re
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from google.cloud import storage
+from google.api_core.exceptions import NotFound
+from CustomException import *
+from cache import LRUCache
+
+INDEX_PREFIX = "_index/commits"
+
+# Above this many unresolved shas a bulk lookup lists the repo's index prefix
+# once instead of issuing one GET per sha
+BULK_LIST_THRESHOLD = int(os.getenv("COMMIT_INDEX_BULK_THRESHOLD", "20"))
+BULK_GET_WORKERS = int(os.getenv("COMMIT_INDEX_BULK_WORKERS", "16"))
+COMMIT_INDEX_CACHE_SIZE = int(os.getenv("COMMIT_INDEX_CACHE_SIZE", "50000"))
+
+# Legacy layout written by the analyzers: {branch}/commits/{timestamp}_{repo}_{sha}.txt
+LEGACY_DOC_PATTERN = re.compile(
+    r"^(?P<branch>.+)/commits/(?P<timestamp>\d{8}_\d{6})_(?P<repo>.+)_(?P<sha>[0-9a-fA-F]{7,64})\.txt$"
+)
+
+# Content-addressed layout: {repo}/by-sha/{sha[:2]}/{sha}
+CAS_DOC_PATTERN = re.compile(
+    r"^(?P<repo>.+)/by-sha/(?P<shard>[0-9a-fA-F]{2})/(?P<sha>[0-9a-fA-F]{7,64})$"
+)
+
+_storage_client = None
+_client_lock = threading.Lock()
+
+# In-process tier of the index: (bucket_name, repo_name, commit_sha) -> blob_name
+_commit_index = LRUCache(COMMIT_INDEX_CACHE_SIZE)
+
+
+def get_storage_client():
+    """Return a process-wide GCS client instead of building one per call"""
+    global _storage_client
+    if _storage_client is None:
+        with _client_lock:
+            if _storage_client is None:
+                _storage_client = storage.Client()
+    return _storage_client
+
+
+def index_blob_name(repo_name, commit_sha):
+    """Name of the marker object for a commit"""
+    return f"{INDEX_PREFIX}/{repo_name}/{commit_sha}"
+
+
+def commit_doc_blob_name(repo_name, commit_sha):
+    """Deterministic content-addressed blob name for a commit's documentation"""
+    return f"{repo_name}/by-sha/{commit_sha[:2]}/{commit_sha}"
+
+
+def parse_doc_blob_name(blob_name):
+    """Return (repo_name, commit_sha) for a documentation blob in either layout, or None"""
+    match = CAS_DOC_PATTERN.match(blob_name)
+    if match and match.group("shard") == match.group("sha")[:2]:
+        return match.group("repo"), match.group("sha")
+    return parse_legacy_doc_name(blob_name)
+
+
+def parse_legacy_doc_name(blob_name):
+    """Return (repo_name, commit_sha) for a legacy documentation blob, or None"""
+    match = LEGACY_DOC_PATTERN.match(blob_name)
+    if not match:
+        return None
+    return match.group("repo"), match.group("sha")
+
+
+def record_commit_doc(bucket_name, repo_name, commit_sha, blob_name):
+    """Point the index entry for a commit at its documentation blob"""
+    try:
+        bucket = get_storage_client().bucket(bucket_name)
+        marker = bucket.blob(index_blob_name(repo_name, commit_sha))
+        marker.metadata = {"doc_blob": blob_name}
+        marker.upload_from_string(blob_name, content_type="text/plain")
+    except Exception as e:
+        raise GoogleCloudStorageError(f"Error updating commit index: {str(e)}")
+
+    _commit_index.put((bucket_name, repo_name, commit_sha), blob_name)
+
+
+def lookup_commit_doc(bucket_name, repo_name, commit_sha, check_cas=True):
+    """Return the documentation blob name for a commit, or None if it was never documented"""
+    key = (bucket_name, repo_name, commit_sha)
+    blob_name = _commit_index.get(key)
+    if blob_name:
+        return blob_name
+
+    try:
+        bucket = get_storage_client().bucket(bucket_name)
+        marker = bucket.get_blob(index_blob_name(repo_name, commit_sha))
+    except Exception as e:
+        raise GoogleCloudStorageError(f"Error reading commit index: {str(e)}")
+
+    blob_name = (marker.metadata or {}).get("doc_blob") if marker is not None else None
+    if not blob_name and check_cas:
+        blob_name = _lookup_cas_doc(bucket, repo_name, commit_sha)
+
+    if blob_name:
+        _commit_index.put(key, blob_name)
+    return blob_name
+
+
+def _lookup_cas_doc(bucket, repo_name, commit_sha):
+    """Content-addressed blob name of a commit's doc if it exists, found even if its marker write failed"""
+    cas_name = commit_doc_blob_name(repo_name, commit_sha)
+    try:
+        return cas_name if bucket.get_blob(cas_name) is not None else None
+    except Exception as e:
+        raise GoogleCloudStorageError(f"Error reading commit documentation: {str(e)}")
+
+
+def lookup_commit_docs(bucket_name, repo_name, commit_shas):
+    """Resolve documentation blob names for many commits at once.
+
+    Returns a dict of commit_sha -> blob_name containing only the commits that
+    have documentation. Shas not already cached are resolved either by one
+    listing of the repo's index prefix or by concurrent marker GETs, whichever
+    is cheaper for the number of shas left. Either way, shas without a marker
+    are looked for in the content-addressed layout, as lookup_commit_doc does.
+    """
+    resolved = {}
+    missing = []
+    for commit_sha in dict.fromkeys(commit_shas):
+        blob_name = _commit_index.get((bucket_name, repo_name, commit_sha))
+        if blob_name:
+            resolved[commit_sha] = blob_name
+        else:
+            missing.append(commit_sha)
+
+    if not missing:
+        return resolved
+
+    if len(missing) > BULK_LIST_THRESHOLD:
+        wanted = set(missing)
+        prefix = f"{INDEX_PREFIX}/{repo_name}/"
+        bucket = get_storage_client().bucket(bucket_name)
+        try:
+            for marker in bucket.list_blobs(prefix=prefix):
+                commit_sha = marker.name[len(prefix):]
+                blob_name = (marker.metadata or {}).get("doc_blob")
+                if commit_sha in wanted and blob_name:
+                    resolved[commit_sha] = blob_name
+                    _commit_index.put((bucket_name, repo_name, commit_sha), blob_name)
+        except Exception as e:
+            raise GoogleCloudStorageError(f"Error listing commit index: {str(e)}")
+
+        # Same answer as a per-sha lookup, whatever the batch size
+        unlisted = [commit_sha for commit_sha in missing if commit_sha not in resolved]
+        if unlisted:
+            with ThreadPoolExecutor(max_workers=min(BULK_GET_WORKERS, len(unlisted))) as executor:
+                blob_names = executor.map(lambda sha: _lookup_cas_doc(bucket, repo_name, sha), unlisted)
+                for commit_sha, blob_name in zip(unlisted, blob_names):
+                    if blob_name:
+                        resolved[commit_sha] = blob_name
+                        _commit_index.put((bucket_name, repo_name, commit_sha), blob_name)
+        return resolved
+
+    with ThreadPoolExecutor(max_workers=min(BULK_GET_WORKERS, len(missing))) as executor:
+        blob_names = executor.map(lambda sha: lookup_commit_doc(bucket_name, repo_name, sha), missing)
+        for commit_sha, blob_name in zip(missing, blob_names):
+            if blob_name:
+                resolved[commit_sha] = blob_name
+
+    return resolved
+
+
+def read_commit_doc(bucket_name, repo_name, commit_sha):
+    """Return the documentation text for a commit, or None if there is none"""
+    bucket = get_storage_client().bucket(bucket_name)
+
+    # Fast path: one GET against the content-addressed layout
+    try:
+        return bucket.blob(commit_doc_blob_name(repo_name, commit_sha)).download_as_text()
+    except NotFound:
+        pass
+
+    blob_name = lookup_commit_doc(bucket_name, repo_name, commit_sha, check_cas=False)
+    if not blob_name or blob_name == commit_doc_blob_name(repo_name, commit_sha):
+        return None
+
+    try:
+        return bucket.blob(blob_name).download_as_text()
+    except NotFound:
+        # The index points at a blob that has since been removed
+        return None
+
+
+def rebuild_commit_index(bucket_name):
+    """Rebuild the index from the documentation blobs already in the bucket.
+
+    Existing markers are left untouched unless a content-addressed copy of the
+    doc exists, in which case the marker is pointed at it. An interrupted
+    rebuild can simply be run again.
+    """
+    bucket = get_storage_client().bucket(bucket_name)
+
+    existing = {
+        marker.name: (marker.metadata or {}).get("doc_blob")
+        for marker in bucket.list_blobs(prefix=f"{INDEX_PREFIX}/")
+    }
+
+    added = 0
+    for blob in bucket.list_blobs():
+        if blob.name.startswith(f"{INDEX_PREFIX}/"):
+            continue
+
+        parsed = parse_doc_blob_name(blob.name)
+        if not parsed:
+            continue
+
+        repo_name, commit_sha = parsed
+        marker_name = index_blob_name(repo_name, commit_sha)
+        is_cas = blob.name == commit_doc_blob_name(repo_name, commit_sha)
+        if marker_name in existing and (not is_cas or existing[marker_name] == blob.name):
+            continue
+
+        record_commit_doc(bucket_name, repo_name, commit_sha, blob.name)
+        existing[marker_name] = blob.name
+        added += 1
+
+    print(f"Commit index rebuilt for {bucket_name}: {added} entries added")
+    return added
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3 or sys.argv[1] != "rebuild":
+        print("Usage: python commit_index.py rebuild <bucket_name>")
+        sys.exit(1)
+    rebuild_commit_index(sys.argv[2])
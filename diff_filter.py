@@ -0,0 +1,131 @@
+# diff_filter.py
+"""
+Pre-filter for commit diffs before they reach the LLM.
+
+Lockfiles, minified bundles, snapshots, vendored code, generated and binary
+files spend prompt tokens without improving the documentation. Their diffs
+are replaced by one-line stubs, so the model still knows the file changed.
+Files whose patch is longer than a cap are stubbed the same way.
+
+Rules can be set per repository with DIFF_FILTER_CONFIG, a JSON object keyed
+by repository (or project) name, with "*" applying to every repository:
+
+    {"*": {"exclude": ["docs/api/**"]},
+     "my-repo": {"include": ["vendor/our-lib/**"], "max_file_lines": 5000}}
+
+"exclude" globs are added to the defaults, "include" globs win over every
+exclusion, and "max_file_lines" replaces the default size cap.
+"""
+import fnmatch
+import json
+import os
+from commit_diff import CommitDiff
+
+DIFF_FILTER_ENABLED = os.getenv("DIFF_FILTER_ENABLED", "true").lower() in ("1", "true", "yes")
+DIFF_MAX_FILE_LINES = int(os.getenv("DIFF_MAX_FILE_LINES", "3000"))
+
+DEFAULT_EXCLUDE_GLOBS = [
+    # Lockfiles
+    "package-lock.json", "npm-shrinkwrap.json", "yarn.lock", "pnpm-lock.yaml", "bun.lockb",
+    "poetry.lock", "Pipfile.lock", "pdm.lock", "uv.lock", "Cargo.lock", "go.sum",
+    "composer.lock", "Gemfile.lock", "mix.lock", "pubspec.lock", "packages.lock.json",
+    # Minified and bundled output
+    "*.min.js", "*.min.css", "*.bundle.js", "*.chunk.js", "*.map",
+    "dist/*", "build/*", "out/*",
+    # Snapshots
+    "*.snap", "*/__snapshots__/*",
+    # Vendored dependencies
+    "vendor/*", "*/vendor/*", "node_modules/*", "*/node_modules/*", "third_party/*",
+    # Generated code
+    "*.pb.go", "*_pb2.py", "*_pb2_grpc.py", "*.g.dart", "*.generated.*", "*.designer.cs",
+]
+
+BINARY_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".pdf", ".zip", ".gz",
+    ".tar", ".tgz", ".jar", ".war", ".class", ".so", ".dll", ".dylib", ".exe", ".bin",
+    ".woff", ".woff2", ".ttf", ".otf", ".eot", ".mp3", ".mp4", ".mov", ".avi", ".pyc",
+}
+
+# Markers tools put at the top of files they generate
+GENERATED_MARKERS = ("@generated", "do not edit", "code generated by", "auto-generated", "autogenerated")
+GENERATED_MARKER_LINES = 10
+
+
+def _load_config():
+    raw = os.getenv("DIFF_FILTER_CONFIG")
+    if not raw:
+        return {}
+    try:
+        return json.loads(raw)
+    except ValueError as e:
+        print(f"Warning: Ignoring invalid DIFF_FILTER_CONFIG: {str(e)}")
+        return {}
+
+
+_config = _load_config()
+
+
+def _rules_for(repo_name):
+    rules = {"exclude": list(DEFAULT_EXCLUDE_GLOBS), "include": [], "max_file_lines": DIFF_MAX_FILE_LINES}
+    for key in ("*", repo_name):
+        repo_rules = _config.get(key) or {}
+        rules["exclude"].extend(repo_rules.get("exclude", []))
+        rules["include"].extend(repo_rules.get("include", []))
+        if "max_file_lines" in repo_rules:
+            rules["max_file_lines"] = int(repo_rules["max_file_lines"])
+    return rules
+
+
+def _matches(path, patterns):
+    name = path.rsplit("/", 1)[-1]
+    # fnmatch's * also matches "/", so "vendor/*" covers everything under vendor/;
+    # patterns without a directory part also match the bare file name
+    return any(
+        fnmatch.fnmatchcase(path, pattern) or ("/" not in pattern and fnmatch.fnmatchcase(name, pattern))
+        for pattern in patterns
+    )
+
+
+def _exclusion_reason(file_diff, rules):
+    """Why a file's diff should be left out of the prompt, or None to keep it"""
+    path = file_diff.path or ""
+    if _matches(path, rules["include"]):
+        return None
+    if _matches(path, rules["exclude"]):
+        return "excluded by filter rules"
+
+    extension = os.path.splitext(path)[1].lower()
+    if extension in BINARY_EXTENSIONS or file_diff.binary:
+        return "binary file"
+
+    # Only lines that really sit at the top of the file can carry a generator's marker
+    head = file_diff.top_lines(GENERATED_MARKER_LINES)
+    if any(marker in line.lower() for line in head for marker in GENERATED_MARKERS):
+        return "generated file"
+
+    lines = file_diff.line_count
+    if lines > rules["max_file_lines"]:
+        return f"diff of {lines} lines exceeds the {rules['max_file_lines']} line cap"
+    return None
+
+
+def filter_commit_diff(commit_diff, repo_name):
+    """Return a copy of commit_diff with excluded files replaced by one-line stubs"""
+    if not DIFF_FILTER_ENABLED:
+        return commit_diff
+
+    rules = _rules_for(repo_name)
+    files = []
+    stubbed = 0
+    for file_diff in commit_diff.files:
+        reason = _exclusion_reason(file_diff, rules)
+        if reason is None:
+            files.append(file_diff)
+            continue
+
+        files.append(file_diff.stub(reason))
+        stubbed += 1
+
+    if stubbed:
+        print(f"Diff filter replaced {stubbed} of {len(files)} files with stubs")
+    return CommitDiff(files)
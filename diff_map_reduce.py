@@ -0,0 +1,103 @@
+# diff_map_reduce.py
+"""
+Chunked documentation of diffs too large for one prompt.
+
+When a commit's diff doesn't fit in its share of the prompt budget, the
+structured diff is split into chunks by file (and by hunk for oversized
+files), each chunk is documented concurrently on the smaller summary model,
+and the partial documentation replaces the diff in the final prompt, which
+then acts as the reduce pass on the main model. Generation time for huge
+commits is bounded by DIFF_MAP_CONCURRENCY rather than by diff size.
+"""
+import asyncio
+import os
+from diff_filter import filter_commit_diff
+from jobs import stage_timer
+from llm_clients import SUMMARY_MODEL, get_chain
+from token_budget import COMMIT_PROMPT_SHARES, allocate, context_budget, count_tokens, fit_sections, truncate_to_tokens
+
+DIFF_MAP_REDUCE = os.getenv("DIFF_MAP_REDUCE", "true").lower() in ("1", "true", "yes")
+# Tokens of diff per map chunk, kept well inside the summary model's context
+DIFF_CHUNK_TOKENS = min(int(os.getenv("DIFF_CHUNK_TOKENS", "6000")), context_budget(SUMMARY_MODEL))
+DIFF_MAP_CONCURRENCY = int(os.getenv("DIFF_MAP_CONCURRENCY", "4"))
+
+MAP_PROMPT = """You are documenting part {part} of {parts} of a large commit.
+
+Repository: {repo_name}
+Commit Message: {message}
+
+Describe the changes in this part of the diff concisely for developers:
+new or modified API endpoints (path, method, purpose), new or changed
+functions and classes, configuration and database changes. Include concrete
+names, parameters and return values. Skip formatting-only changes.
+
+Changes:
+{diff}
+
+DOCUMENTATION OF THIS PART:"""
+
+
+async def document_diff_chunks(chunks, repo_name, commit_message):
+    """Document each diff chunk concurrently and return the combined partial documentation"""
+    chain = get_chain(MAP_PROMPT, SUMMARY_MODEL, 0.1)
+    semaphore = asyncio.Semaphore(DIFF_MAP_CONCURRENCY)
+
+    async def document(part, chunk):
+        async with semaphore:
+            response = await chain.ainvoke({
+                "part": part,
+                "parts": len(chunks),
+                "repo_name": repo_name,
+                "message": commit_message,
+                "diff": truncate_to_tokens(chunk, DIFF_CHUNK_TOKENS),
+            })
+        return response.content if hasattr(response, "content") else str(response)
+
+    partial_docs = await asyncio.gather(*(document(part, chunk) for part, chunk in enumerate(chunks, start=1)))
+    return "\n\n".join(
+        f"### Part {part} of {len(chunks)}\n{partial_doc}"
+        for part, partial_doc in enumerate(partial_docs, start=1)
+    )
+
+
+async def prepare_commit_sections(project_context, previous_documentation, commit_diff, repo_name, commit_sha, commit_message):
+    """Fit the commit prompt's sections to the token budget.
+
+    The diff is first passed through the repository's diff filter. A diff
+    still over its allowance is documented chunk by chunk, when that is
+    enabled, so the final prompt reduces the partial documentation instead of
+    seeing a trimmed diff.
+    """
+    # Lockfiles, generated, vendored and binary files are stubbed out first
+    commit_diff = filter_commit_diff(commit_diff, repo_name)
+    diff_text = commit_diff.render()
+    sizes = {
+        "project_context": count_tokens(project_context),
+        "previous_documentation": count_tokens(previous_documentation),
+        "diff": count_tokens(diff_text),
+    }
+    diff_allowance = allocate(sizes, COMMIT_PROMPT_SHARES)["diff"]
+
+    if DIFF_MAP_REDUCE and sizes["diff"] > diff_allowance:
+        chunks = commit_diff.chunks(DIFF_CHUNK_TOKENS, count_tokens)
+        if len(chunks) > 1:
+            print(f"Diff of {commit_sha} is {sizes['diff']} tokens, documenting it in {len(chunks)} chunks")
+            try:
+                with stage_timer("map_diff", commit=commit_sha, chunks=len(chunks)):
+                    partial_docs = await document_diff_chunks(chunks, repo_name, commit_message)
+            except Exception as e:
+                # A trimmed diff still documents the commit
+                print(f"Warning: Chunked documentation of {commit_sha} failed, trimming the diff instead: {str(e)}")
+            else:
+                diff_text = (
+                    "The diff was too large for one prompt. Below are the changed files with "
+                    "the functions and classes they touch, then documentation of each part of "
+                    "the diff; merge it into one coherent document.\n\n"
+                    f"Changed files:\n{commit_diff.summary()}\n\n{partial_docs}"
+                )
+
+    return fit_sections({
+        "project_context": project_context,
+        "previous_documentation": previous_documentation,
+        "diff": diff_text,
+    }, COMMIT_PROMPT_SHARES)
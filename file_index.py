@@ -0,0 +1,165 @@
+# file_index.py
+"""
+File path -> recent documented commits index stored in GCS.
+
+Every documented commit is appended to one small JSON record per changed
+file at ``_index/files/{repo_name}/{sha256(file_path)}``, holding the newest
+FILE_INDEX_HISTORY commits that touched the file, each with a short summary
+of that commit's documentation. The newest summaries are the file's rolling
+documentation summary: previous documentation for a commit's files is read
+with one GET per file, with no provider API or LLM calls. The analyzers only
+ask GitHub/GitLab about files the index has never seen, and only summarize
+docs for entries recorded without a summary.
+
+Records are updated with generation preconditions so concurrent writers for
+the same file don't lose each other's commits.
+"""
+import datetime
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from CustomException import *
+from commit_index import get_storage_client
+
+FILE_INDEX_PREFIX = "_index/files"
+FILE_INDEX_HISTORY = int(os.getenv("FILE_INDEX_HISTORY", "10"))
+FILE_INDEX_WORKERS = int(os.getenv("FILE_INDEX_WORKERS", "16"))
+FILE_INDEX_WRITE_RETRIES = 5
+
+# Changed files considered for previous documentation; index lookups are cheap
+PREVIOUS_DOCS_MAX_FILES = int(os.getenv("PREVIOUS_DOCS_MAX_FILES", "20"))
+# Files the index has never seen that may still be looked up through the provider API
+PREVIOUS_DOCS_PROVIDER_FILES = int(os.getenv("PREVIOUS_DOCS_PROVIDER_FILES", "5"))
+
+
+def file_record_blob_name(repo_name, file_path):
+    """Name of the index record for a file"""
+    path_hash = hashlib.sha256(file_path.encode("utf-8")).hexdigest()
+    return f"{FILE_INDEX_PREFIX}/{repo_name}/{path_hash}"
+
+
+def _timestamp(date):
+    try:
+        return datetime.datetime.fromisoformat(date.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+def _sort_key(entry):
+    # Commits are documented concurrently and out of order, so order by commit date
+    return _timestamp(entry.get("date")) or 0.0
+
+
+def _read_record(blob):
+    """Return (record, generation) of a record blob, with generation 0 if it doesn't exist"""
+    try:
+        blob.reload()
+        record = json.loads(blob.download_as_text(if_generation_match=blob.generation))
+        return record, blob.generation
+    except NotFound:
+        return None, 0
+
+
+def _add_commit(bucket, repo_name, file_path, commit_sha, commit_date, summary):
+    blob = bucket.blob(file_record_blob_name(repo_name, file_path))
+    for _ in range(FILE_INDEX_WRITE_RETRIES):
+        try:
+            record, generation = _read_record(blob)
+        except PreconditionFailed:
+            # Rewritten between the metadata and content reads
+            continue
+
+        record = record or {"path": file_path, "commits": []}
+        commits = [entry for entry in record["commits"] if entry["sha"] != commit_sha]
+        commits.append({"sha": commit_sha, "date": commit_date, "summary": summary})
+        commits.sort(key=_sort_key, reverse=True)
+        record["commits"] = commits[:FILE_INDEX_HISTORY]
+
+        try:
+            blob.upload_from_string(
+                json.dumps(record),
+                content_type="application/json",
+                if_generation_match=generation,
+            )
+            return
+        except PreconditionFailed:
+            # Another commit touching the same file was recorded first; merge again
+            continue
+
+    raise GoogleCloudStorageError(f"Error updating file index for {file_path}: too many concurrent updates")
+
+
+def record_file_commits(bucket_name, repo_name, commit_sha, file_paths, commit_date, summary=None):
+    """Add a documented commit, and the summary of its documentation, to the records of the files it changed"""
+    file_paths = list(dict.fromkeys(path for path in file_paths if path))
+    if not file_paths:
+        return
+
+    bucket = get_storage_client().bucket(bucket_name)
+    errors = []
+
+    def add(file_path):
+        try:
+            _add_commit(bucket, repo_name, file_path, commit_sha, commit_date, summary)
+        except GoogleCloudStorageError as e:
+            errors.append(str(e))
+        except Exception as e:
+            errors.append(f"Error updating file index for {file_path}: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=min(FILE_INDEX_WORKERS, len(file_paths))) as executor:
+        list(executor.map(add, file_paths))
+
+    if errors:
+        raise GoogleCloudStorageError("; ".join(errors))
+
+
+def rolling_file_summary(entries):
+    """Combine the recorded summaries of a file's recent commits into its documentation context"""
+    return "\n\n---\n\n".join(
+        f"Documentation for commit {entry['sha'][:7]}:\n{entry['summary']}" for entry in entries
+    )
+
+
+def lookup_file_commits(bucket_name, repo_name, file_paths, current_commit_sha, per_file=2, current_commit_date=None):
+    """Return ({file_path: [commit entry, ...]}, [files with no record]).
+
+    Entries are {"sha", "date", "summary"} dicts for the newest documented
+    commits dated before current_commit_date; summary is None for commits
+    recorded without one. Commits documented out of order (concurrent pushes,
+    redelivered webhooks, re-runs of an older commit) may already be in a
+    record, so without a usable current_commit_date only current_commit_sha
+    itself is left out. Files the index has never seen are returned
+    separately so callers can fall back to the provider API for just those.
+    """
+    bucket = get_storage_client().bucket(bucket_name)
+
+    def fetch(file_path):
+        try:
+            return json.loads(bucket.blob(file_record_blob_name(repo_name, file_path)).download_as_text())
+        except NotFound:
+            return None
+        except Exception as e:
+            print(f"Warning: Could not read file index for {file_path}: {str(e)}")
+            return None
+
+    if not file_paths:
+        return {}, []
+
+    with ThreadPoolExecutor(max_workers=min(FILE_INDEX_WORKERS, len(file_paths))) as executor:
+        records = list(executor.map(fetch, file_paths))
+
+    current_timestamp = _timestamp(current_commit_date)
+    found = {}
+    missing = []
+    for file_path, record in zip(file_paths, records):
+        if record is None:
+            missing.append(file_path)
+            continue
+        entries = [entry for entry in record.get("commits", []) if entry["sha"] != current_commit_sha]
+        if current_timestamp is not None:
+            entries = [entry for entry in entries if _sort_key(entry) < current_timestamp]
+        found[file_path] = entries[:per_file]
+
+    return found, missing
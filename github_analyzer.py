@@ -1,17 +1,25 @@
 import json
 import os
-import requests
+import httpx
 import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
-from langchain_groq import ChatGroq
+from llm_clients import DOCUMENTATION_MODEL, get_chain
 # from langchain.chains import LLMChain
-from google.cloud import storage
 from CustomException import *
+from http_clients import API_CONCURRENCY, async_http_get, async_http_post, get_async_http_client
+from commit_diff import CommitDiff, DiffParser
+from token_budget import COMMIT_PROMPT_SHARES, merge_to_floor, section_budget
+from diff_map_reduce import prepare_commit_sections
+from file_index import PREVIOUS_DOCS_MAX_FILES, PREVIOUS_DOCS_PROVIDER_FILES, lookup_file_commits, record_file_commits, rolling_file_summary
+import asyncio
 import certifi
 from httpx import Client
-from utils import summarize_with_llm_async, get_repository_readme_async
+from utils import summarize_with_llm_async
+from project_context import get_project_context_github
+from jobs import stage_timer
+from pipeline import run_stage_graph
+from commit_index import commit_doc_blob_name, get_storage_client, read_commit_doc, record_commit_doc
 
 
 
@@ -24,6 +32,12 @@ GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 # OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./output")
 bucket_name = os.getenv("BUCKET_NAME")
 key_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Build the diff from the patches in the commit JSON instead of a second request
+GITHUB_DIFF_FROM_JSON = os.getenv("GITHUB_DIFF_FROM_JSON", "true").lower() in ("1", "true", "yes")
+# Look up the history of all changed files in one GraphQL query instead of one REST call per file
+GITHUB_GRAPHQL_HISTORY = os.getenv("GITHUB_GRAPHQL_HISTORY", "true").lower() in ("1", "true", "yes")
+# The commit JSON lists at most this many files per page
+GITHUB_COMMIT_FILES_PAGE_LIMIT = 300
 
 
 #llm context awarness implementation
@@ -41,15 +55,41 @@ def get_changed_files_from_commit(commit_data):
     
     return changed_files
 
+def commit_data_from_push(commit):
+    """Shape a commit of a push webhook payload like the commit API response.
+
+    Returns None when the payload lacks any of the fields analyze_commit needs,
+    in which case the commit is fetched from the API as before.
+    """
+    author = commit.get("author") or {}
+    if not commit.get("id") or "message" not in commit or not author.get("name") or not commit.get("timestamp"):
+        return None
+    if not any(key in commit for key in ("added", "modified", "removed")):
+        return None
+
+    files = [
+        {"filename": file_path}
+        for key in ("added", "modified", "removed")
+        for file_path in commit.get(key) or []
+    ]
+    return {
+        "sha": commit["id"],
+        "commit": {
+            "author": {"name": author["name"], "email": author.get("email", ""), "date": commit["timestamp"]},
+            "message": commit["message"],
+        },
+        "files": files,
+    }
+
 # Function to get previous commits for a specific file
-def get_previous_commits_for_file(repo_owner, repo_name, file_path, current_commit_sha):
+async def get_previous_commits_for_file(repo_owner, repo_name, file_path, current_commit_sha):
     """Get the 2 most recent commits that modified a specific file before current commit"""
     headers = {"Authorization": f"token {GITHUB_TOKEN}"}
     
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/commits?path={file_path}&per_page=5"
     
     try:
-        response = requests.get(url, headers=headers)
+        response = await async_http_get(url, headers=headers)
         
         if response.status_code != 200:
             print(f"Error fetching commits for {file_path}: {response.status_code}")
@@ -70,38 +110,119 @@ def get_previous_commits_for_file(repo_owner, repo_name, file_path, current_comm
                 break
                 
         return previous_commits
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error connecting to GitHub API: {str(e)}")
         return []
     
+# Function to get previous commits for several files in one request
+async def get_previous_commits_for_files(repo_owner, repo_name, file_paths, current_commit_sha, per_file=2):
+    """Get the most recent commits before current_commit_sha for each file, in one GraphQL query.
+
+    Returns {file_path: [commit sha, ...]}. Files the query could not answer
+    fall back to get_previous_commits_for_file.
+    """
+    file_to_commits = {}
+    if not file_paths:
+        return file_to_commits
+
+    if GITHUB_GRAPHQL_HISTORY:
+        # One aliased history(path:) field per file, walked from the current commit
+        variable_defs = "".join(f", $p{i}: String!" for i in range(len(file_paths)))
+        fields = "\n        ".join(
+            f"f{i}: history(first: {per_file + 1}, path: $p{i}) {{ nodes {{ oid }} }}"
+            for i in range(len(file_paths))
+        )
+        query = f"""query($owner: String!, $name: String!, $oid: GitObjectID!{variable_defs}) {{
+  repository(owner: $owner, name: $name) {{
+    object(oid: $oid) {{
+      ... on Commit {{
+        {fields}
+      }}
+    }}
+  }}
+}}"""
+        variables = {"owner": repo_owner, "name": repo_name, "oid": current_commit_sha}
+        variables.update({f"p{i}": file_path for i, file_path in enumerate(file_paths)})
+
+        try:
+            response = await async_http_post(
+                "https://api.github.com/graphql",
+                json={"query": query, "variables": variables},
+                headers={"Authorization": f"bearer {GITHUB_TOKEN}"},
+            )
+            if response.status_code == 200:
+                commit = ((response.json().get("data") or {}).get("repository") or {}).get("object") or {}
+                for i, file_path in enumerate(file_paths):
+                    history = commit.get(f"f{i}")
+                    if history is None:
+                        continue
+                    shas = [node["oid"] for node in history.get("nodes", []) if node["oid"] != current_commit_sha]
+                    file_to_commits[file_path] = shas[:per_file]
+            else:
+                print(f"Error fetching file history via GraphQL: {response.status_code}")
+        except httpx.HTTPError as e:
+            print(f"Error connecting to GitHub GraphQL API: {str(e)}")
+
+    # REST fallback, one request per file the batched query didn't answer
+    missing = [file_path for file_path in file_paths if file_path not in file_to_commits]
+    if missing:
+        semaphore = asyncio.Semaphore(API_CONCURRENCY)
+
+        async def commits_for_file(file_path):
+            async with semaphore:
+                return await get_previous_commits_for_file(repo_owner, repo_name, file_path, current_commit_sha)
+
+        results = await asyncio.gather(*(commits_for_file(file_path) for file_path in missing))
+        for file_path, previous_commits in zip(missing, results):
+            file_to_commits[file_path] = previous_commits[:per_file]
+
+    return file_to_commits
+
 #Function to find commit documentation in GCS bucket
 def find_commit_documentation_in_gcs(bucket_name, repo_name, commit_sha):
     """Find documentation for a specific commit in GCS bucket"""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    
-    # List all blobs in the bucket
-    blobs = list(bucket.list_blobs())
-    
-    for blob in blobs:
-        if commit_sha in blob.name and repo_name in blob.name:
-            # Found the documentation
-            with blob.open("r") as f:
-                return f.read()
-    
-    return None
+    # Resolved through the sha-keyed commit index instead of listing the bucket
+    return read_commit_doc(bucket_name, repo_name, commit_sha)
 
 
 # Fetching previous commits for changed files and summarizing documentation
-async def get_previous_documentation_for_files(repo_owner, repo_name, changed_files, current_commit_sha, bucket_name):
+async def get_previous_documentation_for_files(repo_owner, repo_name, changed_files, current_commit_sha, bucket_name, current_commit_date=None):
     """Get and summarize documentation from previous commits for changed files"""
-    # Track file-to-commits mapping
-    file_to_commits = {}
-    
-    # Step 1: First identify all relevant commits for each file
-    for file_path in changed_files[:5]:  # Limit to 5 files
-        previous_commits = get_previous_commits_for_file(repo_owner, repo_name, file_path, current_commit_sha)
-        file_to_commits[file_path] = previous_commits[:2]  # Limit to 2 commits per file
+    # Lookups for different files and commits are independent, so they run
+    # concurrently, bounded by the semaphore
+    semaphore = asyncio.Semaphore(API_CONCURRENCY)
+
+    async def doc_for_commit(commit_sha):
+        async with semaphore:
+            return await asyncio.to_thread(find_commit_documentation_in_gcs, bucket_name, repo_name, commit_sha)
+
+    # Step 1: First identify all relevant commits for each file (2 per file),
+    # from the service's own file index where it knows the file
+    files = changed_files[:PREVIOUS_DOCS_MAX_FILES]
+    file_to_commits, unindexed = {}, files
+    previous_docs = {}
+    if bucket_name:
+        try:
+            indexed, unindexed = await asyncio.to_thread(
+                lookup_file_commits, bucket_name, repo_name, files, current_commit_sha, 2, current_commit_date
+            )
+        except Exception as e:
+            indexed = {}
+            print(f"Warning: Could not read file index: {str(e)}")
+
+        for file_path, entries in indexed.items():
+            if entries and all(entry.get("summary") for entry in entries):
+                # The file's rolling summary: no doc reads and no LLM calls
+                previous_docs[file_path] = rolling_file_summary(entries)
+            else:
+                file_to_commits[file_path] = [entry["sha"] for entry in entries]
+
+    # Only files the index has never seen cost GitHub API calls
+    fallback_files = unindexed[:PREVIOUS_DOCS_PROVIDER_FILES]
+    if fallback_files:
+        file_to_commits.update(
+            await get_previous_commits_for_files(repo_owner, repo_name, fallback_files, current_commit_sha, per_file=2)
+        )
     
     # Step 2: Get unique commits across all files
     all_unique_commits = set()
@@ -109,14 +230,12 @@ async def get_previous_documentation_for_files(repo_owner, repo_name, changed_fi
         all_unique_commits.update(commits)
     
     # Step 3: Fetch documentation for unique commits only
-    commit_to_docs = {}
-    for commit_sha in all_unique_commits:
-        doc = find_commit_documentation_in_gcs(bucket_name, repo_name, commit_sha)
-        if doc:
-            commit_to_docs[commit_sha] = doc
+    unique_commits = list(all_unique_commits)
+    docs = await asyncio.gather(*(doc_for_commit(commit_sha) for commit_sha in unique_commits))
+    commit_to_docs = {commit_sha: doc for commit_sha, doc in zip(unique_commits, docs) if doc}
     
     # Step 4: Create summaries for each file based on its commits
-    previous_docs = {}
+    combined_docs = {}
     for file_path, commits in file_to_commits.items():
         file_docs = []
         for commit_sha in commits:
@@ -124,11 +243,24 @@ async def get_previous_documentation_for_files(repo_owner, repo_name, changed_fi
                 file_docs.append(f"Documentation for commit {commit_sha[:7]}:\n{commit_to_docs[commit_sha]}")
         
         if file_docs:
-            combined_doc = "\n\n---\n\n".join(file_docs)
-            summary = await summarize_with_llm_async(combined_doc, "documentation")
-            previous_docs[file_path] = summary
-    
-    return previous_docs
+            combined_docs[file_path] = "\n\n---\n\n".join(file_docs)
+
+    # A file's docs are only summarized when they exceed its share of the budget;
+    # files too many to each get MIN_ITEM_TOKENS are summarized together
+    combined_tokens = section_budget(COMMIT_PROMPT_SHARES, "previous_documentation") * len(combined_docs) // max(1, len(combined_docs) + len(previous_docs))
+    combined_docs = merge_to_floor(combined_docs, combined_tokens)
+    per_file_tokens = combined_tokens // max(1, len(combined_docs))
+    summaries = await asyncio.gather(
+        *(
+            summarize_with_llm_async(combined_doc, "documentation", max_tokens=per_file_tokens)
+            for combined_doc in combined_docs.values()
+        )
+    )
+    previous_docs.update(zip(combined_docs.keys(), summaries))
+
+    # Keep the changed files' order; merged files sit where their first file would
+    position = {file_path: index for index, file_path in enumerate(files)}
+    return dict(sorted(previous_docs.items(), key=lambda item: position.get(item[0].split(", ")[0], len(files))))
 
 #Format the summaries into a context string
 def format_previous_documentation_context(previous_docs):
@@ -147,13 +279,6 @@ def format_previous_documentation_context(previous_docs):
 # Configure llm
 def setup_llm():
 
-    # Pass the preconfigured client to ChatGroq
-    llm = ChatGroq(
-        groq_api_key=GROQ_API_KEY,
-        model_name="llama-3.3-70b-versatile",
-        temperature=0.2
-    )
-
     prompt_text = """
                 You are a Technical Documentation Specialist who creates concise, practical release documentation from code changes.
 
@@ -202,15 +327,10 @@ Generate documentation that highlights practical, actionable information about t
 Use the project context and previous documentation to better understand the purpose of the files and how they've evolved. Reference previous changes when relevant to provide continuity in the documentation.
                  """
 
-    prompt = PromptTemplate(
-        input_variables=["repo_name", "commit_sha", "author", "message", "project_context", "previous_documentation", "diff"],
-        template=prompt_text
-    )
-
-    return prompt | llm
+    return get_chain(prompt_text, DOCUMENTATION_MODEL, 0.2)
 
     #get commit details using github api
-def get_commit_details(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA):
+async def get_commit_details(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA):
 
     
     headers = {
@@ -221,7 +341,7 @@ def get_commit_details(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA):
     url = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}/commits/{COMMIT_SHA}"
     
     try:
-        response = requests.get(url,headers=headers)
+        response = await async_http_get(url,headers=headers)
 
         if response.status_code == 200:
             print(f"Successfully retrieved commit details for {COMMIT_SHA} in {GITHUB_REPO}.")
@@ -230,37 +350,53 @@ def get_commit_details(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA):
             raise CommitNotFoundError(f"Commit {COMMIT_SHA} not found in {GITHUB_REPO}.")
         else:
             raise GitHubAPIError (f"Error getting commit details: {response.status_code} - {response.text}")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise GitHubAPIError(f"Error connecting to GitHub API: {str(e)}")
 
+def has_complete_patches(commit_data):
+    """True when the commit JSON holds the patch of every changed text file.
+
+    GitHub omits the patch of files whose diff is too large, and lists only
+    the first page of files of very large commits.
+    """
+    files = commit_data.get("files") or []
+    if not files or len(files) >= GITHUB_COMMIT_FILES_PAGE_LIMIT:
+        return False
+    # Binary files have no patch but also no line changes
+    return all("patch" in file or file.get("changes", 0) == 0 for file in files)
+
     #get commit diff using github api
-def get_commit_diff(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA):
+async def get_commit_diff(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA):
+    """Get the commit diff, parsed into a CommitDiff while it downloads"""
     headers = {"Authorization": f"token {GITHUB_TOKEN}",
                "Accept": "application/vnd.github.v3.diff"}
 
     url = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}/commits/{COMMIT_SHA}"    
 
     try:
-        response = requests.get(url, headers=headers)
-
-        if response.status_code == 200:
-                # Make sure we're properly parsing the JSON response
+        async with get_async_http_client(url).stream("GET", url, headers=headers) as response:
+            if response.status_code == 200:
+                parser = DiffParser()
+                async for line in response.aiter_lines():
+                    parser.feed(line)
                 print(f"Successfully retrieved commit diff for {COMMIT_SHA} in {GITHUB_REPO}.")
-                return response.text
-        elif response.status_code == 404:
-            raise CommitNotFoundError(f"Commit {COMMIT_SHA} not found in {GITHUB_REPO}.")
-        else:
-            raise GitHubAPIError (f"Error getting commit details: {response.status_code} - {response.text}")
-    except requests.exceptions.RequestException as e:
+                return parser.close()
+            elif response.status_code == 404:
+                raise CommitNotFoundError(f"Commit {COMMIT_SHA} not found in {GITHUB_REPO}.")
+            else:
+                await response.aread()
+                raise GitHubAPIError (f"Error getting commit details: {response.status_code} - {response.text}")
+    except httpx.HTTPError as e:
         raise GitHubAPIError(f"Error connecting to GitHub API: {str(e)}")
     
     #save explanation to gcs bucket
 def upload_to_gcs(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA, bucket_name, blob_name,author_name,author_email,commit_date,commit_message,explanation,branch_name):
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_storage_client().bucket(bucket_name)
         blob = bucket.blob(blob_name)
 
         blob.content_type = "text/plain"
+        # The branch is no longer part of the blob name, so keep it on the object
+        blob.metadata = {"branch": branch_name}
 
         try:
             with blob.open("w") as f:
@@ -276,34 +412,82 @@ def upload_to_gcs(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA, bucket_name, blob_name,a
         except GoogleCloudStorageError as e:
             raise GoogleCloudStorageError(f"Error uploading to GCS: {e}")
         else:
+            try:
+                record_commit_doc(bucket_name, GITHUB_REPO, COMMIT_SHA, blob_name)
+            except GoogleCloudStorageError as e:
+                # The documentation itself is stored; only the index entry is missing
+                print(f"Warning: {str(e)}")
             return f"gs://{bucket_name}/{blob_name}"
 
     #analyze github commit 
-async def analyze_commit(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA,branch_name):
+async def analyze_commit(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA,branch_name, push_commit=None):
+    """Document a commit; push_commit is the commit from the push webhook payload, if any"""
+    # The push payload already has the metadata and changed files, leaving only the diff to fetch
+    webhook_data = commit_data_from_push(push_commit) if push_commit else None
+
+    async def fetch_commit_details(results):
+        if webhook_data is not None:
+            return webhook_data
+        commit_data = await get_commit_details(GITHUB_OWNER, GITHUB_REPO, COMMIT_SHA)
+        if not commit_data:
+            print(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
+            raise AnalyzerError(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
+        return commit_data
 
-    try:
-        commit_data= get_commit_details(GITHUB_OWNER, GITHUB_REPO, COMMIT_SHA)
-    except CommitNotFoundError as e:
-        raise
+    async def fetch_commit_diff(results):
+        if webhook_data is not None:
+            commit_data = None
+        else:
+            commit_data = results["commit_details"]
+        # The commit JSON already carries every file's patch unless GitHub left some out
+        if GITHUB_DIFF_FROM_JSON and isinstance(commit_data, dict) and has_complete_patches(commit_data):
+            return CommitDiff.from_github(commit_data.get("files", []))
+
+        commit_diff = await get_commit_diff(GITHUB_OWNER, GITHUB_REPO, COMMIT_SHA)
+        if not commit_diff:
+            print(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
+            raise AnalyzerError(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
+        return commit_diff
+
+    #Gather project context
+    async def gather_project_context(results):
+        # Cached README summary, revalidated with one conditional request
+        project_context = await get_project_context_github(GITHUB_OWNER, GITHUB_REPO)
+        print(f"Project context: {project_context}")
+        return project_context
+
+    # Get changed files and summarize their previous documentation
+    async def gather_previous_documentation(results):
+        commit_data = results["commit_details"]
+        changed_files = get_changed_files_from_commit(commit_data) if isinstance(commit_data, dict) else []
+        print(f"Found {len(changed_files)} changed files in this commit")
+        commit_date = commit_data.get("commit", {}).get("author", {}).get("date") if isinstance(commit_data, dict) else None
+
+        previous_docs = await get_previous_documentation_for_files(
+            GITHUB_OWNER, GITHUB_REPO, changed_files, COMMIT_SHA, bucket_name, commit_date
+        )
+        print(f"Retrieved and summarized previous documentation")
+        return format_previous_documentation_context(previous_docs)
+
+    # Project context runs alongside the commit fetch; the diff and previous
+    # documentation are both derived from the commit JSON
+    stage_results = await run_stage_graph({
+        "commit_details": ((), fetch_commit_details),
+        "commit_diff": (("commit_details",), fetch_commit_diff),
+        "project_context": ((), gather_project_context),
+        "previous_documentation": (("commit_details",), gather_previous_documentation),
+    }, commit=COMMIT_SHA)
+
+    commit_data = stage_results["commit_details"]
+    commit_diff = stage_results["commit_diff"]
+    project_context = stage_results["project_context"]
+    previous_docs_context = stage_results["previous_documentation"]
 
-    if not commit_data:
-        print(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
-        raise AnalyzerError(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
-    
     # Check if commit_data is a dictionary
     if not isinstance(commit_data, dict):
         print(f"Error: Expected dictionary but got {type(commit_data)}")
         return commit_data
     
-    try:
-        commit_diff = get_commit_diff(GITHUB_OWNER, GITHUB_REPO, COMMIT_SHA)
-    except CommitNotFoundError as e:
-        raise
-
-    if not commit_diff:
-        print(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
-        raise AnalyzerError(f"Could not analyze commit {COMMIT_SHA} in {GITHUB_REPO}.")
-    
     #commit data
     try:
         author_name = commit_data['commit']['author']['name']
@@ -315,35 +499,25 @@ async def analyze_commit(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA,branch_name):
         print(f"Available keys: {commit_data.keys() if isinstance(commit_data, dict) else 'Not a dictionary'}")
         return None
 
-    #Gather project context
-    readme_content = await get_repository_readme_async(GITHUB_OWNER, GITHUB_REPO)
-    project_context = await summarize_with_llm_async(readme_content, "readme")
-    print(f"Project context: {project_context}")
-    # Get changed files and previous documentation
-    changed_files = get_changed_files_from_commit(commit_data)
-    print(f"Found {len(changed_files)} changed files in this commit")
-    
-    # Get and summarize previous documentation
-    previous_docs = await get_previous_documentation_for_files(
-        GITHUB_OWNER, GITHUB_REPO, changed_files, COMMIT_SHA, bucket_name
+    # Keep the prompt within the token budget; the diff gets whatever room the
+    # context sections leave, and a diff too large for it is documented in chunks
+    sections = await prepare_commit_sections(
+        project_context, previous_docs_context, commit_diff, GITHUB_REPO, COMMIT_SHA, commit_message
     )
 
-    previous_docs_context = format_previous_documentation_context(previous_docs)
-    print(f"Retrieved and summarized previous documentation")
-
-
     chain = setup_llm()
 
     try:
-        response = chain.invoke({
-            "repo_name": GITHUB_REPO,
-            "commit_sha": COMMIT_SHA,
-            "author": author_name,
-            "message": commit_message,
-            "project_context": project_context,
-            "previous_documentation": previous_docs_context,
-            "diff": commit_diff
-        })
+        with stage_timer("generate_documentation", commit=COMMIT_SHA):
+            response = await chain.ainvoke({
+                "repo_name": GITHUB_REPO,
+                "commit_sha": COMMIT_SHA,
+                "author": author_name,
+                "message": commit_message,
+                "project_context": sections["project_context"],
+                "previous_documentation": sections["previous_documentation"],
+                "diff": sections["diff"]
+            })
 
         if hasattr(response, "content"):
             explanation = response.content
@@ -353,18 +527,31 @@ async def analyze_commit(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA,branch_name):
             explanation = str(response)
     
     except Exception as e:
-        raise (f"Error generating explanation: {e}")
+        raise AnalyzerError(f"Error generating explanation: {e}")
 
        
     
-    #save explanation to file
-    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-
-    
+    #save explanation to the content-addressed path for this commit
     if bucket_name:
         try:
-            blob_name = f"{branch_name}/commits/{timestamp}_{GITHUB_REPO}_{COMMIT_SHA}.txt"
-            gcs_path = upload_to_gcs(GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA, bucket_name,blob_name,author_name,author_email,commit_date,commit_message,explanation,branch_name)
+            blob_name = commit_doc_blob_name(GITHUB_REPO, COMMIT_SHA)
+            with stage_timer("upload", commit=COMMIT_SHA):
+                gcs_path = await asyncio.to_thread(upload_to_gcs, GITHUB_OWNER,GITHUB_REPO, COMMIT_SHA, bucket_name,blob_name,author_name,author_email,commit_date,commit_message,explanation,branch_name)
+            with stage_timer("file_index", commit=COMMIT_SHA):
+                # Summarized once here so later commits touching these files need no LLM call for context
+                try:
+                    doc_summary = await summarize_with_llm_async(explanation, "documentation")
+                except Exception as e:
+                    print(f"Warning: Could not summarize documentation for the file index: {str(e)}")
+                    doc_summary = None
+                try:
+                    await asyncio.to_thread(
+                        record_file_commits, bucket_name, GITHUB_REPO, COMMIT_SHA,
+                        get_changed_files_from_commit(commit_data), commit_date, doc_summary
+                    )
+                except GoogleCloudStorageError as e:
+                    # The documentation itself is stored; only the file index entries are missing
+                    print(f"Warning: {str(e)}")
             return gcs_path
         except Exception as e:
             raise GoogleCloudStorageError(f"Error uploading to GCS: {e}")
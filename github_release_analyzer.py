@@ -1,16 +1,19 @@
 import json
 import os
-import requests
+import httpx
 import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
-from langchain_groq import ChatGroq
+from llm_clients import DOCUMENTATION_MODEL, get_chain
 from langchain.chains import LLMChain
-from google.cloud import storage
 from CustomException import *
-from httpx import Client
-from utils import summarize_with_llm_async,get_repository_readme_async
+from http_clients import async_http_get
+import asyncio
+from jobs import stage_timer
+from commit_index import get_storage_client
+from release_docs import collect_commit_docs
+from project_context import get_project_context_github
+from release_index import github_repo_key, previous_release_tag
 load_dotenv()
 
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
@@ -19,47 +22,48 @@ OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./output")
 bucket_name_release = os.getenv("PROJECT_NAME")
 bucket_name_commit = os.getenv("BUCKET_NAME")
 key_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Commits per page of the compare and commits endpoints (GitHub caps per_page at 100)
+GITHUB_COMMITS_PAGE_SIZE = int(os.getenv("GITHUB_COMMITS_PAGE_SIZE", "100"))
+GITHUB_RELEASES_PAGE_SIZE = 100
 
 async def generate_release_note(repo_owner, repo_name, release_tag, release_name, release_body, created_at):
     try:
-        previous_tag = get_previous_release_tag(repo_owner, repo_name, release_tag)
-
-        commits = get_commits_between_tags(repo_owner, repo_name, previous_tag, release_tag)
-
-        commit_docs = []
-        for commit in commits:
-            try:
-                commit_sha = commit["sha"]
-                doc_path = find_commit_documentation(bucket_name_commit, repo_name, commit_sha)
-                if doc_path:
-                    doc_content = await read_gcs_file(bucket_name_commit, doc_path)
-                    commit_docs.append({
-                        'documentation': doc_content,
-                    })
-            except GoogleCloudStorageError as e:
-                # Log but continue processing other commits
-                print(f"Warning: Could not read documentation for commit {commit_sha}: {str(e)}")
-                continue
-
-            #Gather project context
-        readme_content = await get_repository_readme_async(repo_owner, repo_name)
-        project_context = await summarize_with_llm_async(readme_content, "readme")
+        with stage_timer("previous_tag", release=release_tag):
+            previous_tag = await get_previous_release_tag(repo_owner, repo_name, release_tag)
+
+        # The whole commit range is resolved in one lookup, then the docs are
+        # read and summarized concurrently
+        with stage_timer("commit_docs", release=release_tag):
+            commit_docs = await collect_commit_docs(
+                bucket_name_commit,
+                repo_name,
+                iter_commits_between_tags(repo_owner, repo_name, previous_tag, release_tag),
+            )
+
+        # Gather project context
+        with stage_timer("project_context", release=release_tag):
+            # Cached README summary, revalidated with one conditional request
+            project_context = await get_project_context_github(repo_owner, repo_name)
         print(f"Project context: {project_context}")
             
-        release_notes = generate_note(
-            repo_name,
-            release_tag,
-            release_name,
-            previous_tag,
-            release_body,
-            commit_docs,
-            project_context
-        )
+        with stage_timer("generate_release_note", release=release_tag):
+            release_notes = await asyncio.to_thread(
+                generate_note,
+                repo_name,
+                release_tag,
+                release_name,
+                previous_tag,
+                release_body,
+                commit_docs,
+                project_context
+            )
 
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         blob_name = f"{repo_name}/releases/{release_tag}/{timestamp}_release_note.md"
 
-        return upload_to_gcs(bucket_name_release, blob_name, repo_owner, repo_name, release_tag, release_name, created_at, release_notes)
+        with stage_timer("upload", release=release_tag):
+            release_note_path = await asyncio.to_thread(upload_to_gcs, bucket_name_release, blob_name, repo_owner, repo_name, release_tag, release_name, created_at, release_notes)
+        return release_note_path
 
     except GitHubAPIError as e:
         raise
@@ -71,112 +75,77 @@ async def generate_release_note(repo_owner, repo_name, release_tag, release_name
         # Catch any unexpected exceptions and wrap them
         raise AnalyzerError(f"Unexpected error while generating release note: {str(e)}")
 
-def get_previous_release_tag(repo_owner, repo_name, release_tag):
+async def list_releases(repo_owner, repo_name):
+    """Every release of a repository as (tag, created_at) pairs, following pagination"""
     url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/releases"
     headers = {"Authorization":f"token {GITHUB_TOKEN}"}
+    params = {"per_page": GITHUB_RELEASES_PAGE_SIZE}
 
+    releases = []
     try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            releases = response.json()
-            release_sorted = sorted(releases, key=lambda x: x['created_at'])
-            previous_tag = None
+        while url:
+            response = await async_http_get(url, headers=headers, params=params)
 
-            for release in release_sorted:
-                if release['tag_name'] == release_tag:
-                    return previous_tag
-                previous_tag = release['tag_name']
+            if response.status_code == 404:
+                raise GitHubAPIError(f"Repository {repo_owner}/{repo_name} not found")
+            elif response.status_code != 200:
+                raise GitHubAPIError(f"Failed to fetch releases: {response.status_code} - {response.text}")
 
-            return None
-        elif response.status_code == 404:
-            raise GitHubAPIError(f"Repository {repo_owner}/{repo_name} not found")
-        else:
-            raise GitHubAPIError(f"Failed to fetch releases: {response.status_code} - {response.text}")
-            
-    except requests.exceptions.RequestException as e:
+            releases.extend((release['tag_name'], release['created_at']) for release in response.json())
+            url = response.links.get("next", {}).get("url")
+            params = None
+    except httpx.HTTPError as e:
         raise GitHubAPIError(f"Error connecting to GitHub API: {str(e)}")
 
-def get_commits_between_tags(repo_owner, repo_name, previous_tag, release_tag):
+    return releases
+
+async def get_previous_release_tag(repo_owner, repo_name, release_tag):
+    """Tag of the release created before release_tag, from the cached release index"""
+    return await previous_release_tag(
+        github_repo_key(repo_owner, repo_name),
+        release_tag,
+        lambda: list_releases(repo_owner, repo_name),
+    )
+
+async def iter_commits_between_tags(repo_owner, repo_name, previous_tag, release_tag):
+    """Yield the commits of a release a page at a time"""
     headers = {"Authorization": f"token {GITHUB_TOKEN}"}
 
-    try:
-        if previous_tag is None:
-            url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/commits?per_page=50"
-        else:
-            url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/compare/{previous_tag}...{release_tag}"
+    if previous_tag is None:
+        # First release: everything reachable from the tag, newest first
+        url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/commits"
+        params = {"sha": release_tag, "per_page": GITHUB_COMMITS_PAGE_SIZE}
+    else:
+        url = f"https://api.github.com/repos/{repo_owner}/{repo_name}/compare/{previous_tag}...{release_tag}"
+        params = {"per_page": GITHUB_COMMITS_PAGE_SIZE}
 
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if previous_tag is None:
-                return data
-            else:
-                return data.get("commits", [])
-        elif response.status_code == 404:
-            if previous_tag is None:
-                raise GitHubAPIError(f"Repository {repo_owner}/{repo_name} not found")
-            else:
-                raise GitHubAPIError(f"Cannot compare tags: {previous_tag} or {release_tag} not found")
-        else:
-            raise GitHubAPIError(f"Failed to fetch commits: {response.status_code} - {response.text}")
-            
-    except requests.exceptions.RequestException as e:
-        raise GitHubAPIError(f"Error connecting to GitHub API: {str(e)}")
-    
-def find_commit_documentation(bucket_name, repo_name, commit_sha):
-    if not bucket_name:
-        raise GoogleCloudStorageError("No commit documentation bucket specified")
-        
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-
-        blobs = bucket.list_blobs(prefix=f"")
+        while url:
+            response = await async_http_get(url, headers=headers, params=params)
 
-        for blob in blobs:
-            if commit_sha in blob.name and repo_name in blob.name:
-                return blob.name
-        
-        return None
-    except Exception as e:
-        raise GoogleCloudStorageError(f"Error finding commit documentation: {str(e)}")
+            if response.status_code == 404:
+                if previous_tag is None:
+                    raise GitHubAPIError(f"Repository {repo_owner}/{repo_name} or tag {release_tag} not found")
+                raise GitHubAPIError(f"Cannot compare tags: {previous_tag} or {release_tag} not found")
+            elif response.status_code != 200:
+                raise GitHubAPIError(f"Failed to fetch commits: {response.status_code} - {response.text}")
 
-async def read_gcs_file(bucket_name, blob_name):
-    if not bucket_name or not blob_name:
-        raise GoogleCloudStorageError("Missing bucket name or blob name")
-        
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
+            data = response.json()
+            commits = data if previous_tag is None else data.get("commits", [])
+            if commits:
+                yield commits
+
+            # The Link header holds the full URL of the next page, query included
+            url = response.links.get("next", {}).get("url")
+            params = None
+    except httpx.HTTPError as e:
+        raise GitHubAPIError(f"Error connecting to GitHub API: {str(e)}")
 
-        if not blob.exists():
-            return None
-        
-        with blob.open("r") as f:
-            return await summarize_with_llm_async(f.read())
-    except Exception as e:
-        raise GoogleCloudStorageError(f"Error reading file from GCS: {str(e)}")
-    
 def generate_note(repo_name, release_tag, release_name, previous_tag, release_body, commit_docs, project_context):
     if not GROQ_API_KEY:
         raise AnalyzerError("GROQ API key not configured")
         
     try:
-        http_client = Client(
-        verify=False,  # Disable SSL verification
-        timeout=60.0   # Optional timeout setting
-    )
-        
-        llm = ChatGroq(
-            groq_api_key=GROQ_API_KEY,
-            model_name="llama-3.3-70b-versatile",
-            temperature=0.2,
-            http_client=http_client
-        )
-
         prompt_text = ''' You are a Technical Documentation Specialist tasked with creating comprehensive release notes.
 
         Generate detailed release notes for version {release_tag} of {repo_name}. This release moves from previous version {previous_tag} to {release_tag}.
@@ -210,12 +179,7 @@ def generate_note(repo_name, release_tag, release_name, previous_tag, release_bo
         Use the project context to better understand the purpose of the commits and how they've evolved. Reference previous changes when relevant to provide continuity in the release note.
         '''
 
-        prompt = PromptTemplate(
-            input_variables=["repo_name", "release_tag", "release_name", "previous_tag", "release_body", "commit_docs","project_context"],
-            template=prompt_text
-        )
-        
-        chain = prompt | llm
+        chain = get_chain(prompt_text, DOCUMENTATION_MODEL, 0.2)
         
         response = chain.invoke({
             "repo_name": repo_name,
@@ -238,8 +202,7 @@ def upload_to_gcs(bucket_name, blob_name, repo_owner, repo_name, release_tag, re
         raise GoogleCloudStorageError("No release notes bucket specified")
         
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_storage_client().bucket(bucket_name)
         blob = bucket.blob(blob_name)
         blob.content_type = "text/markdown"
 
@@ -1,17 +1,25 @@
 # gitlab_analyzer.py
 import json
 import os
-import requests
+import httpx
 import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
-from langchain_groq import ChatGroq
-from google.cloud import storage
+from llm_clients import DOCUMENTATION_MODEL, get_chain
 from CustomException import *
+from http_clients import API_CONCURRENCY, async_http_get
+from commit_diff import CommitDiff
+from token_budget import COMMIT_PROMPT_SHARES, merge_to_floor, section_budget
+from diff_map_reduce import prepare_commit_sections
+from file_index import PREVIOUS_DOCS_MAX_FILES, PREVIOUS_DOCS_PROVIDER_FILES, lookup_file_commits, record_file_commits, rolling_file_summary
+import asyncio
 import certifi
 from httpx import Client
-from utils import summarize_with_llm_async, get_repository_readme_gitlab
+from utils import GITLAB_API_URL, summarize_with_llm_async
+from project_context import get_project_context_gitlab
+from jobs import stage_timer
+from pipeline import run_stage_graph
+from commit_index import commit_doc_blob_name, get_storage_client, read_commit_doc, record_commit_doc
 
 load_dotenv()
 
@@ -19,38 +27,17 @@ GITLAB_TOKEN = os.getenv("GITLAB_TOKEN")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 bucket_name = os.getenv("GITLAB_COMMIT_BUCKET")
 key_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Files per page of the commit diff endpoint (GitLab caps per_page at 100)
+GITLAB_DIFF_PAGE_SIZE = int(os.getenv("GITLAB_DIFF_PAGE_SIZE", "100"))
 
-def get_changed_files_from_gitlab_commit(project_id, commit_sha):
-    """Extract list of files changed in this commit from GitLab API"""
-    headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
-    url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/commits/{commit_sha}/diff"
-    
-    try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code != 200:
-            raise GitLabAPIError(f"Error fetching commit diff: {response.status_code} - {response.text}")
-            
-        diff_data = response.json()
-        changed_files = []
-        
-        for file_diff in diff_data:
-            file_path = file_diff.get("new_path", "")
-            if file_path:
-                changed_files.append(file_path)
-        
-        return changed_files
-    except requests.exceptions.RequestException as e:
-        raise GitLabAPIError(f"Error connecting to GitLab API: {str(e)}")
-
-def get_previous_commits_for_file_gitlab(project_id, file_path, current_commit_sha):
+async def get_previous_commits_for_file_gitlab(project_id, file_path, current_commit_sha):
     """Get the 2 most recent commits that modified a specific file before current commit in GitLab"""
     headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
     
-    url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/commits?path={file_path}&per_page=5"
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/commits?path={file_path}&per_page=5"
     
     try:
-        response = requests.get(url, headers=headers)
+        response = await async_http_get(url, headers=headers)
         
         if response.status_code != 200:
             print(f"Error fetching commits for {file_path}: {response.status_code}")
@@ -71,19 +58,50 @@ def get_previous_commits_for_file_gitlab(project_id, file_path, current_commit_s
                 break
                 
         return previous_commits
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         print(f"Error connecting to GitLab API: {str(e)}")
         return []
 
-async def get_previous_documentation_for_files_gitlab(project_id, project_name, changed_files, current_commit_sha, bucket_name):
+async def get_previous_documentation_for_files_gitlab(project_id, project_name, changed_files, current_commit_sha, bucket_name, current_commit_date=None):
     """Get and summarize documentation from previous commits for changed files in GitLab"""
-    # Track file-to-commits mapping
-    file_to_commits = {}
-    
-    # Step 1: First identify all relevant commits for each file
-    for file_path in changed_files[:5]:  # Limit to 5 files
-        previous_commits = get_previous_commits_for_file_gitlab(project_id, file_path, current_commit_sha)
-        file_to_commits[file_path] = previous_commits[:2]  # Limit to 2 commits per file
+    # Lookups for different files and commits are independent, so they run
+    # concurrently, bounded by the semaphore
+    semaphore = asyncio.Semaphore(API_CONCURRENCY)
+
+    async def commits_for_file(file_path):
+        async with semaphore:
+            return await get_previous_commits_for_file_gitlab(project_id, file_path, current_commit_sha)
+
+    async def doc_for_commit(commit_sha):
+        async with semaphore:
+            return await asyncio.to_thread(find_commit_documentation_in_gcs, bucket_name, project_name, commit_sha)
+
+    # Step 1: First identify all relevant commits for each file (2 per file),
+    # from the service's own file index where it knows the file
+    files = changed_files[:PREVIOUS_DOCS_MAX_FILES]
+    file_to_commits, unindexed = {}, files
+    previous_docs = {}
+    if bucket_name:
+        try:
+            indexed, unindexed = await asyncio.to_thread(
+                lookup_file_commits, bucket_name, project_name, files, current_commit_sha, 2, current_commit_date
+            )
+        except Exception as e:
+            indexed = {}
+            print(f"Warning: Could not read file index: {str(e)}")
+
+        for file_path, entries in indexed.items():
+            if entries and all(entry.get("summary") for entry in entries):
+                # The file's rolling summary: no doc reads and no LLM calls
+                previous_docs[file_path] = rolling_file_summary(entries)
+            else:
+                file_to_commits[file_path] = [entry["sha"] for entry in entries]
+
+    # Only files the index has never seen cost GitLab API calls
+    fallback_files = unindexed[:PREVIOUS_DOCS_PROVIDER_FILES]
+    file_commits = await asyncio.gather(*(commits_for_file(file_path) for file_path in fallback_files))
+    for file_path, previous_commits in zip(fallback_files, file_commits):
+        file_to_commits[file_path] = previous_commits[:2]
     
     # Step 2: Get unique commits across all files
     all_unique_commits = set()
@@ -91,14 +109,12 @@ async def get_previous_documentation_for_files_gitlab(project_id, project_name,
         all_unique_commits.update(commits)
     
     # Step 3: Fetch documentation for unique commits only
-    commit_to_docs = {}
-    for commit_sha in all_unique_commits:
-        doc = find_commit_documentation_in_gcs(bucket_name, project_name, commit_sha)
-        if doc:
-            commit_to_docs[commit_sha] = doc
+    unique_commits = list(all_unique_commits)
+    docs = await asyncio.gather(*(doc_for_commit(commit_sha) for commit_sha in unique_commits))
+    commit_to_docs = {commit_sha: doc for commit_sha, doc in zip(unique_commits, docs) if doc}
     
     # Step 4: Create summaries for each file based on its commits
-    previous_docs = {}
+    combined_docs = {}
     for file_path, commits in file_to_commits.items():
         file_docs = []
         for commit_sha in commits:
@@ -106,11 +122,24 @@ async def get_previous_documentation_for_files_gitlab(project_id, project_name,
                 file_docs.append(f"Documentation for commit {commit_sha[:7]}:\n{commit_to_docs[commit_sha]}")
         
         if file_docs:
-            combined_doc = "\n\n---\n\n".join(file_docs)
-            summary = await summarize_with_llm_async(combined_doc, "documentation")
-            previous_docs[file_path] = summary
-    
-    return previous_docs
+            combined_docs[file_path] = "\n\n---\n\n".join(file_docs)
+
+    # A file's docs are only summarized when they exceed its share of the budget;
+    # files too many to each get MIN_ITEM_TOKENS are summarized together
+    combined_tokens = section_budget(COMMIT_PROMPT_SHARES, "previous_documentation") * len(combined_docs) // max(1, len(combined_docs) + len(previous_docs))
+    combined_docs = merge_to_floor(combined_docs, combined_tokens)
+    per_file_tokens = combined_tokens // max(1, len(combined_docs))
+    summaries = await asyncio.gather(
+        *(
+            summarize_with_llm_async(combined_doc, "documentation", max_tokens=per_file_tokens)
+            for combined_doc in combined_docs.values()
+        )
+    )
+    previous_docs.update(zip(combined_docs.keys(), summaries))
+
+    # Keep the changed files' order; merged files sit where their first file would
+    position = {file_path: index for index, file_path in enumerate(files)}
+    return dict(sorted(previous_docs.items(), key=lambda item: position.get(item[0].split(", ")[0], len(files))))
 
 def format_previous_documentation_context_gitlab(previous_docs):
     """Format previous documentation summaries into a context string for GitLab"""
@@ -127,30 +156,13 @@ def format_previous_documentation_context_gitlab(previous_docs):
 
 def find_commit_documentation_in_gcs(bucket_name, project_name, commit_sha):
     """Find documentation for a specific commit in GCS bucket"""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
-    
-    # List all blobs in the bucket
-    blobs = list(bucket.list_blobs())
-    
-    for blob in blobs:
-        if commit_sha in blob.name and project_name in blob.name:
-            # Found the documentation
-            with blob.open("r") as f:
-                return f.read()
-    
-    return None
+    # Resolved through the sha-keyed commit index instead of listing the bucket
+    return read_commit_doc(bucket_name, project_name, commit_sha)
 
 def setup_llm_gitlab():
     
     """Configure LLM for GitLab commit analysis"""
 
-    llm = ChatGroq(
-        groq_api_key=GROQ_API_KEY,
-        model_name="llama-3.3-70b-versatile",
-        temperature=0.2
-    )
-
     prompt_text = """
                 You are a Technical Documentation Specialist who creates concise, practical release documentation from code changes.
 
@@ -199,20 +211,15 @@ Generate documentation that highlights practical, actionable information about t
 Use the project context and previous documentation to better understand the purpose of the files and how they've evolved. Reference previous changes when relevant to provide continuity in the documentation.
                  """
 
-    prompt = PromptTemplate(
-        input_variables=["project_name", "commit_sha", "author", "message", "project_context", "previous_documentation", "diff"],
-        template=prompt_text
-    )
-
-    return prompt | llm
+    return get_chain(prompt_text, DOCUMENTATION_MODEL, 0.2)
 
-def get_commit_details_gitlab(project_id, commit_sha):
+async def get_commit_details_gitlab(project_id, commit_sha):
     """Get commit details using GitLab API"""
     headers = {"PRIVATE-TOKEN": f"{GITLAB_TOKEN}"}
-    url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/commits/{commit_sha}"
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/commits/{commit_sha}"
     
     try:
-        response = requests.get(url, headers=headers)
+        response = await async_http_get(url, headers=headers)
 
         if response.status_code == 200:
             print(f"Successfully retrieved commit details for {commit_sha} in project {project_id}.")
@@ -221,45 +228,42 @@ def get_commit_details_gitlab(project_id, commit_sha):
             raise CommitNotFoundError(f"Commit {commit_sha} not found in project {project_id}.")
         else:
             raise GitLabAPIError(f"Error getting commit details: {response.status_code} - {response.text}")
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise GitLabAPIError(f"Error connecting to GitLab API: {str(e)}")
 
-def get_commit_diff_gitlab(project_id, commit_sha):
-    """Get commit diff using GitLab API"""
+async def get_commit_diff_gitlab(project_id, commit_sha):
+    """Get the commit diff using GitLab API, following every page of large commits"""
     headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
-    url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/commits/{commit_sha}/diff"
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/commits/{commit_sha}/diff"
     
+    entries = []
+    page = "1"
     try:
-        response = requests.get(url, headers=headers)
+        while page:
+            response = await async_http_get(url, headers=headers, params={"page": page, "per_page": GITLAB_DIFF_PAGE_SIZE})
+
+            if response.status_code == 404:
+                raise CommitNotFoundError(f"Commit {commit_sha} not found in project {project_id}.")
+            elif response.status_code != 200:
+                raise GitLabAPIError(f"Error getting commit diff: {response.status_code} - {response.text}")
 
-        if response.status_code == 200:
             # GitLab returns diff as an array of file diffs
-            diff_data = response.json()
-            
-            # Convert to text format similar to GitHub diff
-            diff_text = ""
-            for file_diff in diff_data:
-                diff_text += f"diff --git a/{file_diff.get('old_path')} b/{file_diff.get('new_path')}\n"
-                diff_text += f"--- a/{file_diff.get('old_path')}\n"
-                diff_text += f"+++ b/{file_diff.get('new_path')}\n"
-                diff_text += file_diff.get('diff', '') + "\n\n"
-                
-            print(f"Successfully retrieved commit diff for {commit_sha} in project {project_id}.")
-            return diff_text
-        elif response.status_code == 404:
-            raise CommitNotFoundError(f"Commit {commit_sha} not found in project {project_id}.")
-        else:
-            raise GitLabAPIError(f"Error getting commit diff: {response.status_code} - {response.text}")
-    except requests.exceptions.RequestException as e:
+            entries.extend(response.json())
+            page = response.headers.get("X-Next-Page")
+    except httpx.HTTPError as e:
         raise GitLabAPIError(f"Error connecting to GitLab API: {str(e)}")
 
+    print(f"Successfully retrieved commit diff for {commit_sha} in project {project_id} ({len(entries)} files).")
+    return CommitDiff.from_gitlab(entries)
+
 def upload_to_gcs_gitlab(project_id, project_name, commit_sha, bucket_name, blob_name, author_name, commit_date, commit_message, explanation, branch_name):
     """Save explanation to GCS bucket for GitLab commits"""
-    storage_client = storage.Client()
-    bucket = storage_client.bucket(bucket_name)
+    bucket = get_storage_client().bucket(bucket_name)
     blob = bucket.blob(blob_name)
 
     blob.content_type = "text/plain"
+    # The branch is no longer part of the blob name, so keep it on the object
+    blob.metadata = {"branch": branch_name}
 
     try:
         with blob.open("w") as f:
@@ -275,55 +279,96 @@ def upload_to_gcs_gitlab(project_id, project_name, commit_sha, bucket_name, blob
     except Exception as e:
         raise GoogleCloudStorageError(f"Error uploading to GCS: {e}")
     else:
+        try:
+            record_commit_doc(bucket_name, project_name, commit_sha, blob_name)
+        except GoogleCloudStorageError as e:
+            # The documentation itself is stored; only the index entry is missing
+            print(f"Warning: {str(e)}")
         return f"gs://{bucket_name}/{blob_name}"
 
 async def analyze_gitlab_commit(project_id, project_name, commit_sha, branch_name, author_name, commit_message, commit_timestamp):
     """Analyze GitLab commit and generate documentation"""
     try:
-        # Get commit details - might need this for additional metadata
-        commit_data = get_commit_details_gitlab(project_id, commit_sha)
-        
-        if not commit_data:
-            print(f"Could not analyze commit {commit_sha} in project {project_id}.")
-            raise AnalyzerError(f"Could not analyze commit {commit_sha} in project {project_id}.")
-        
-        # Get commit diff
-        commit_diff = get_commit_diff_gitlab(project_id, commit_sha)
-        
-        if not commit_diff:
-            print(f"Could not get diff for commit {commit_sha} in project {project_id}.")
-            raise AnalyzerError(f"Could not get diff for commit {commit_sha} in project {project_id}.")
-        
+        # Get commit details - only needed when the webhook left out metadata
+        async def fetch_commit_details(results):
+            commit_data = await get_commit_details_gitlab(project_id, commit_sha)
+            if not commit_data:
+                print(f"Could not analyze commit {commit_sha} in project {project_id}.")
+                raise AnalyzerError(f"Could not analyze commit {commit_sha} in project {project_id}.")
+            return commit_data
+
+        # One fetch provides both the diff text and the changed files
+        async def fetch_commit_diff(results):
+            commit_diff = await get_commit_diff_gitlab(project_id, commit_sha)
+            if not commit_diff:
+                print(f"Could not get diff for commit {commit_sha} in project {project_id}.")
+                raise AnalyzerError(f"Could not get diff for commit {commit_sha} in project {project_id}.")
+            print(f"Found {len(commit_diff.changed_files)} changed files in this commit")
+            return commit_diff
+
         # Gather project context
-        readme_content = await get_repository_readme_gitlab(project_id)
-        project_context = await summarize_with_llm_async(readme_content, "readme")
-        print(f"Project context: {project_context}")
-        
-        # Get changed files and previous documentation
-        changed_files = get_changed_files_from_gitlab_commit(project_id, commit_sha)
-        print(f"Found {len(changed_files)} changed files in this commit")
-        
+        async def gather_project_context(results):
+            # Cached README summary, revalidated with one conditional request
+            project_context = await get_project_context_gitlab(project_id)
+            print(f"Project context: {project_context}")
+            return project_context
+
         # Get and summarize previous documentation
-        previous_docs = await get_previous_documentation_for_files_gitlab(
-            project_id, project_name, changed_files, commit_sha, bucket_name
-        )
-        
-        previous_docs_context = format_previous_documentation_context_gitlab(previous_docs)
-        print(f"Retrieved and summarized previous documentation")
+        async def gather_previous_documentation(results):
+            # Only documentation of commits dated before this one counts as previous
+            commit_date = commit_timestamp or (results.get("commit_details") or {}).get("authored_date")
+            previous_docs = await get_previous_documentation_for_files_gitlab(
+                project_id, project_name, results["commit_diff"].changed_files, commit_sha, bucket_name, commit_date
+            )
+            print(f"Retrieved and summarized previous documentation")
+            return format_previous_documentation_context_gitlab(previous_docs)
+
+        # Project context runs alongside the diff; previous documentation starts
+        # as soon as the diff has listed the changed files
+        stages = {
+            "commit_diff": ((), fetch_commit_diff),
+            "project_context": ((), gather_project_context),
+            "previous_documentation": (("commit_diff",), gather_previous_documentation),
+        }
+        # The webhook payload already carries the author, message and timestamp;
+        # the details are only fetched when it doesn't
+        if not (author_name and commit_message and commit_timestamp):
+            stages["commit_details"] = ((), fetch_commit_details)
+            if not commit_timestamp:
+                # The commit date bounds which indexed docs count as previous
+                stages["previous_documentation"] = (("commit_diff", "commit_details"), gather_previous_documentation)
+        stage_results = await run_stage_graph(stages, commit=commit_sha)
+
+        commit_diff = stage_results["commit_diff"]
+        project_context = stage_results["project_context"]
+        previous_docs_context = stage_results["previous_documentation"]
+
+        commit_data = stage_results.get("commit_details")
+        if isinstance(commit_data, dict):
+            author_name = author_name or commit_data.get("author_name")
+            commit_message = commit_message or commit_data.get("message")
+            commit_timestamp = commit_timestamp or commit_data.get("authored_date")
         
+        # Keep the prompt within the token budget; the diff gets whatever room the
+        # context sections leave, and a diff too large for it is documented in chunks
+        sections = await prepare_commit_sections(
+            project_context, previous_docs_context, commit_diff, project_name, commit_sha, commit_message
+        )
+
         # Setup LLM and generate documentation
         chain = setup_llm_gitlab()
         
         try:
-            response = chain.invoke({
-                "project_name": project_name,
-                "commit_sha": commit_sha,
-                "author": author_name,
-                "message": commit_message,
-                "project_context": project_context,
-                "previous_documentation": previous_docs_context,
-                "diff": commit_diff
-            })
+            with stage_timer("generate_documentation", commit=commit_sha):
+                response = await chain.ainvoke({
+                    "project_name": project_name,
+                    "commit_sha": commit_sha,
+                    "author": author_name,
+                    "message": commit_message,
+                    "project_context": sections["project_context"],
+                    "previous_documentation": sections["previous_documentation"],
+                    "diff": sections["diff"]
+                })
             
             if hasattr(response, "content"):
                 explanation = response.content
@@ -335,24 +380,39 @@ async def analyze_gitlab_commit(project_id, project_name, commit_sha, branch_nam
         except Exception as e:
             raise AnalyzerError(f"Error generating explanation: {e}")
         
-        # Save explanation to GCS
-        timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-        
+        # Save explanation to the content-addressed path for this commit
         if bucket_name:
             try:
-                blob_name = f"{branch_name}/commits/{timestamp}_{project_name}_{commit_sha}.txt"
-                gcs_path = upload_to_gcs_gitlab(
-                    project_id, 
-                    project_name, 
-                    commit_sha, 
-                    bucket_name,
-                    blob_name,
-                    author_name,
-                    commit_timestamp,
-                    commit_message,
-                    explanation,
-                    branch_name
-                )
+                blob_name = commit_doc_blob_name(project_name, commit_sha)
+                with stage_timer("upload", commit=commit_sha):
+                    gcs_path = await asyncio.to_thread(
+                        upload_to_gcs_gitlab,
+                        project_id, 
+                        project_name, 
+                        commit_sha, 
+                        bucket_name,
+                        blob_name,
+                        author_name,
+                        commit_timestamp,
+                        commit_message,
+                        explanation,
+                        branch_name
+                    )
+                with stage_timer("file_index", commit=commit_sha):
+                    # Summarized once here so later commits touching these files need no LLM call for context
+                    try:
+                        doc_summary = await summarize_with_llm_async(explanation, "documentation")
+                    except Exception as e:
+                        print(f"Warning: Could not summarize documentation for the file index: {str(e)}")
+                        doc_summary = None
+                    try:
+                        await asyncio.to_thread(
+                            record_file_commits, bucket_name, project_name, commit_sha,
+                            commit_diff.changed_files, commit_timestamp, doc_summary
+                        )
+                    except GoogleCloudStorageError as e:
+                        # The documentation itself is stored; only the file index entries are missing
+                        print(f"Warning: {str(e)}")
                 return gcs_path
             except Exception as e:
                 raise GoogleCloudStorageError(f"Error uploading to GCS: {e}")
@@ -1,17 +1,22 @@
 # gitlab_release_analyzer.py
 import json
 import os
-import requests
+import httpx
 import datetime
 from pathlib import Path
 from dotenv import load_dotenv
-from langchain.prompts import PromptTemplate
-from langchain_groq import ChatGroq
+from llm_clients import DOCUMENTATION_MODEL, get_chain
 from langchain.chains import LLMChain
-from google.cloud import storage
 from CustomException import *
+from http_clients import async_http_get, http_get
+import asyncio
 from httpx import Client
-from utils import summarize_with_llm_async, get_repository_readme_gitlab
+from jobs import stage_timer
+from commit_index import get_storage_client
+from release_docs import collect_commit_docs
+from project_context import get_project_context_gitlab
+from release_index import gitlab_project_key, previous_release_tag
+from utils import GITLAB_API_URL
 
 load_dotenv()
 
@@ -21,34 +26,32 @@ OUTPUT_DIR = os.getenv("OUTPUT_DIR", "./output")
 bucket_name_release = os.getenv("GITLAB_RELEASE_BUCKET")
 bucket_name_commit = os.getenv("GITLAB_COMMIT_BUCKET")
 key_path = os.getenv("GOOGLE_APPLICATION_CREDENTIALS")
+# Commits per page of the commits endpoint (GitLab caps per_page at 100)
+GITLAB_COMMITS_PAGE_SIZE = int(os.getenv("GITLAB_COMMITS_PAGE_SIZE", "100"))
+GITLAB_RELEASES_PAGE_SIZE = 100
 
 async def generate_gitlab_release_note(project_id, project_name, release_tag, release_name, release_body, created_at, context_data=None):
     """Generate release notes with enhanced context data from pipeline"""
     context_data = context_data or {}
     
     try:
-        previous_tag = get_previous_release_tag_gitlab(project_id, release_tag)
-
-        commits = get_commits_between_tags_gitlab(project_id, previous_tag, release_tag)
-
-        commit_docs = []
-        for commit in commits:
-            try:
-                commit_sha = commit["id"]
-                doc_path = find_commit_documentation(bucket_name_commit, project_name, commit_sha)
-                if doc_path:
-                    doc_content = await read_gcs_file(bucket_name_commit, doc_path)
-                    commit_docs.append({
-                        'documentation': doc_content,
-                    })
-            except GoogleCloudStorageError as e:
-                # Log but continue processing other commits
-                print(f"Warning: Could not read documentation for commit {commit_sha}: {str(e)}")
-                continue
+        with stage_timer("previous_tag", release=release_tag):
+            previous_tag = await get_previous_release_tag_gitlab(project_id, release_tag)
+
+        # The whole commit range is resolved in one lookup, then the docs are
+        # read and summarized concurrently
+        with stage_timer("commit_docs", release=release_tag):
+            commit_docs = await collect_commit_docs(
+                bucket_name_commit,
+                project_name,
+                iter_commits_between_tags_gitlab(project_id, previous_tag, release_tag),
+                sha_key="id",
+            )
 
         # Gather project context
-        readme_content = await get_repository_readme_gitlab(project_id)
-        project_context = await summarize_with_llm_async(readme_content, "readme")
+        with stage_timer("project_context", release=release_tag):
+            # Cached README summary, revalidated with one conditional request
+            project_context = await get_project_context_gitlab(project_id)
         print(f"Project context: {project_context}")
             
         # Include pipeline context in release notes generation
@@ -59,16 +62,18 @@ async def generate_gitlab_release_note(project_id, project_name, release_tag, re
         if context_data.get('default_branch'):
             pipeline_context += f"\nDefault branch: {context_data.get('default_branch')}"
             
-        release_notes = generate_note_gitlab(
-            project_name,
-            release_tag,
-            release_name,
-            previous_tag,
-            release_body,
-            commit_docs,
-            project_context,
-            pipeline_context
-        )
+        with stage_timer("generate_release_note", release=release_tag):
+            release_notes = await asyncio.to_thread(
+                generate_note_gitlab,
+                project_name,
+                release_tag,
+                release_name,
+                previous_tag,
+                release_body,
+                commit_docs,
+                project_context,
+                pipeline_context
+            )
 
         timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
         blob_name = f"{project_name}/releases/{release_tag}/{timestamp}_release_note.md"
@@ -86,7 +91,9 @@ async def generate_gitlab_release_note(project_id, project_name, release_tag, re
             "commit_sha": context_data.get('commit_sha', '')
         }
 
-        return upload_to_gcs_release(bucket_name_release, blob_name, metadata, release_notes)
+        with stage_timer("upload", release=release_tag):
+            release_note_path = await asyncio.to_thread(upload_to_gcs_release, bucket_name_release, blob_name, metadata, release_notes)
+        return release_note_path
 
     except GitLabAPIError as e:
         raise
@@ -98,109 +105,74 @@ async def generate_gitlab_release_note(project_id, project_name, release_tag, re
         # Catch any unexpected exceptions and wrap them
         raise AnalyzerError(f"Unexpected error while generating GitLab release note: {str(e)}")
 
-def get_previous_release_tag_gitlab(project_id, release_tag):
-    url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/releases"
+async def list_releases_gitlab(project_id):
+    """Every release of a project as (tag, released_at) pairs, following pagination"""
+    url = f"{GITLAB_API_URL}/projects/{project_id}/releases"
     headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
 
+    releases = []
+    page = "1"
     try:
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            releases = response.json()
-            release_sorted = sorted(releases, key=lambda x: x['released_at'])
-            previous_tag = None
+        while page:
+            response = await async_http_get(url, headers=headers, params={"page": page, "per_page": GITLAB_RELEASES_PAGE_SIZE})
 
-            for release in release_sorted:
-                if release['tag_name'] == release_tag:
-                    return previous_tag
-                previous_tag = release['tag_name']
+            if response.status_code == 404:
+                raise GitLabAPIError(f"Project {project_id} not found")
+            elif response.status_code != 200:
+                raise GitLabAPIError(f"Failed to fetch releases: {response.status_code} - {response.text}")
 
-            return None
-        elif response.status_code == 404:
-            raise GitLabAPIError(f"Project {project_id} not found")
-        else:
-            raise GitLabAPIError(f"Failed to fetch releases: {response.status_code} - {response.text}")
-            
-    except requests.exceptions.RequestException as e:
+            releases.extend((release['tag_name'], release['released_at']) for release in response.json())
+            page = response.headers.get("X-Next-Page")
+    except httpx.HTTPError as e:
         raise GitLabAPIError(f"Error connecting to GitLab API: {str(e)}")
 
-def get_commits_between_tags_gitlab(project_id, previous_tag, release_tag):
-    headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
+    return releases
 
-    try:
-        if previous_tag is None:
-            # If no previous tag, get the most recent commits
-            url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/commits?ref_name={release_tag}&per_page=50"
-        else:
-            # Get commits between tags
-            url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/compare?from={previous_tag}&to={release_tag}"
+async def get_previous_release_tag_gitlab(project_id, release_tag):
+    """Tag of the release made before release_tag, from the cached release index"""
+    return await previous_release_tag(
+        gitlab_project_key(project_id),
+        release_tag,
+        lambda: list_releases_gitlab(project_id),
+    )
 
-        response = requests.get(url, headers=headers)
-        
-        if response.status_code == 200:
-            data = response.json()
-            if previous_tag is None:
-                return data
-            else:
-                return data.get("commits", [])
-        elif response.status_code == 404:
-            if previous_tag is None:
-                raise GitLabAPIError(f"Project {project_id} not found")
-            else:
-                raise GitLabAPIError(f"Cannot compare tags: {previous_tag} or {release_tag} not found")
-        else:
-            raise GitLabAPIError(f"Failed to fetch commits: {response.status_code} - {response.text}")
-            
-    except requests.exceptions.RequestException as e:
-        raise GitLabAPIError(f"Error connecting to GitLab API: {str(e)}")
+async def iter_commits_between_tags_gitlab(project_id, previous_tag, release_tag):
+    """Yield the commits of a release a page at a time"""
+    headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/commits"
+    # The compare endpoint isn't paginated; the commits endpoint takes a
+    # revision range and pages through it newest first
+    ref_name = release_tag if previous_tag is None else f"{previous_tag}..{release_tag}"
 
-def find_commit_documentation(bucket_name, project_name, commit_sha):
-    if not bucket_name:
-        raise GoogleCloudStorageError("No commit documentation bucket specified")
-        
+    page = "1"
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-
-        blobs = bucket.list_blobs(prefix=f"")
-
-        for blob in blobs:
-            if commit_sha in blob.name and project_name in blob.name:
-                return blob.name
-        
-        return None
-    except Exception as e:
-        raise GoogleCloudStorageError(f"Error finding commit documentation: {str(e)}")
+        while page:
+            response = await async_http_get(url, headers=headers, params={
+                "ref_name": ref_name,
+                "page": page,
+                "per_page": GITLAB_COMMITS_PAGE_SIZE,
+            })
+
+            if response.status_code == 404:
+                if previous_tag is None:
+                    raise GitLabAPIError(f"Project {project_id} or tag {release_tag} not found")
+                raise GitLabAPIError(f"Cannot compare tags: {previous_tag} or {release_tag} not found")
+            elif response.status_code != 200:
+                raise GitLabAPIError(f"Failed to fetch commits: {response.status_code} - {response.text}")
 
-async def read_gcs_file(bucket_name, blob_name):
-    if not bucket_name or not blob_name:
-        raise GoogleCloudStorageError("Missing bucket name or blob name")
-        
-    try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(blob_name)
+            commits = response.json()
+            if commits:
+                yield commits
 
-        if not blob.exists():
-            return None
-        
-        with blob.open("r") as f:
-            return await summarize_with_llm_async(f.read(), "documentation")
-    except Exception as e:
-        raise GoogleCloudStorageError(f"Error reading file from GCS: {str(e)}")
+            page = response.headers.get("X-Next-Page")
+    except httpx.HTTPError as e:
+        raise GitLabAPIError(f"Error connecting to GitLab API: {str(e)}")
 
 def generate_note_gitlab(project_name, release_tag, release_name, previous_tag, release_body, commit_docs, project_context, pipeline_context=""):
     if not GROQ_API_KEY:
         raise AnalyzerError("GROQ API key not configured")
         
     try:
-        
-        llm = ChatGroq(
-            groq_api_key=GROQ_API_KEY,
-            model_name="llama-3.3-70b-versatile",
-            temperature=0.2
-        )
-
         prompt_text = ''' You are a Technical Documentation Specialist tasked with creating comprehensive release notes.
 
         Generate detailed release notes for version {release_tag} of {project_name}. This release moves from previous version {previous_tag} to {release_tag}.
@@ -237,12 +209,7 @@ def generate_note_gitlab(project_name, release_tag, release_name, previous_tag,
         Use the project context to better understand the purpose of the commits and how they've evolved. Reference previous changes when relevant to provide continuity in the release note.
         '''
 
-        prompt = PromptTemplate(
-            input_variables=["project_name", "release_tag", "release_name", "previous_tag", "release_body", "commit_docs", "project_context", "pipeline_context"],
-            template=prompt_text
-        )
-        
-        chain = prompt | llm
+        chain = get_chain(prompt_text, DOCUMENTATION_MODEL, 0.2)
         
         response = chain.invoke({
             "project_name": project_name,
@@ -276,8 +243,7 @@ def upload_to_gcs_release(bucket_name, blob_name, metadata, release_notes):
         raise GoogleCloudStorageError("No release notes bucket specified")
         
     try:
-        storage_client = storage.Client()
-        bucket = storage_client.bucket(bucket_name)
+        bucket = get_storage_client().bucket(bucket_name)
         blob = bucket.blob(blob_name)
         blob.content_type = "text/markdown"
 
@@ -304,22 +270,22 @@ def fetch_gitlab_release_data(project_id, tag_name, project_name=None, project_p
     
     # Step 1: Get project details if not provided
     if not project_name or not project_path:
-        project_url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}"
+        project_url = f"{GITLAB_API_URL}/projects/{project_id}"
         try:
-            project_response = requests.get(project_url, headers=headers)
+            project_response = http_get(project_url, headers=headers)
             if project_response.status_code != 200:
                 raise GitLabAPIError(f"Failed to fetch project details: {project_response.status_code}")
             
             project_data = project_response.json()
             project_name = project_name or project_data.get('name')
             project_path = project_path or project_data.get('path_with_namespace')
-        except requests.exceptions.RequestException as e:
+        except httpx.HTTPError as e:
             raise GitLabAPIError(f"Error connecting to GitLab API for project details: {str(e)}")
     
     # Step 2: Get release details
-    release_url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/releases/{tag_name}"
+    release_url = f"{GITLAB_API_URL}/projects/{project_id}/releases/{tag_name}"
     try:
-        release_response = requests.get(release_url, headers=headers)
+        release_response = http_get(release_url, headers=headers)
         if release_response.status_code == 200:
             release_data = release_response.json()
             return {
@@ -335,8 +301,8 @@ def fetch_gitlab_release_data(project_id, tag_name, project_name=None, project_p
             }
         elif release_response.status_code == 404:
             # Release might not exist yet, just get tag info
-            tag_url = f"https://gitlab.kazan.myworldline.com/api/v4/projects/{project_id}/repository/tags/{tag_name}"
-            tag_response = requests.get(tag_url, headers=headers)
+            tag_url = f"{GITLAB_API_URL}/projects/{project_id}/repository/tags/{tag_name}"
+            tag_response = http_get(tag_url, headers=headers)
             
             if tag_response.status_code != 200:
                 # Just return basic info if we can't get tag details
@@ -365,5 +331,5 @@ def fetch_gitlab_release_data(project_id, tag_name, project_name=None, project_p
         else:
             raise GitLabAPIError(f"Failed to fetch release details: {release_response.status_code}")
             
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPError as e:
         raise GitLabAPIError(f"Error connecting to GitLab API for release details: {str(e)}")
\ No newline at end of file
@@ -0,0 +1,98 @@
+# http_clients.py
+"""
+Shared, connection-pooled HTTP clients for the GitHub and GitLab APIs.
+
+One httpx client is kept per scheme+host so that every call to the same API
+reuses pooled keep-alive connections (and HTTP/2 when the ``h2`` package is
+installed) instead of paying a TCP+TLS handshake per request. The analyzer
+coroutines use the async clients, which are kept per event loop because an
+httpx.AsyncClient cannot be shared between loops.
+"""
+import asyncio
+import os
+import threading
+import weakref
+from urllib.parse import urlsplit
+import httpx
+
+HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "20"))
+HTTP_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_KEEPALIVE_CONNECTIONS", "10"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "30"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "10"))
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+HTTP2_ENABLED = HTTP2_AVAILABLE and os.getenv("HTTP2_ENABLED", "true").lower() in ("1", "true", "yes")
+
+# Upper bound on concurrent API requests fanned out for a single commit or release
+API_CONCURRENCY = int(os.getenv("API_CONCURRENCY", "8"))
+
+_clients = {}
+_clients_lock = threading.Lock()
+# event loop -> {host: httpx.AsyncClient}
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _host_key(url):
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def _client_options():
+    return {
+        "limits": httpx.Limits(
+            max_connections=HTTP_POOL_SIZE,
+            max_keepalive_connections=HTTP_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(HTTP_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+        "http2": HTTP2_ENABLED,
+        # requests followed redirects by default; keep that behaviour
+        "follow_redirects": True,
+    }
+
+
+def get_http_client(url):
+    """Return the shared client for the host of url"""
+    key = _host_key(url)
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = httpx.Client(**_client_options())
+                _clients[key] = client
+    return client
+
+
+def http_get(url, headers=None, params=None):
+    """GET url through the pooled client for its host"""
+    return get_http_client(url).get(url, headers=headers, params=params)
+
+
+def get_async_http_client(url):
+    """Return the shared async client for the host of url on the running event loop"""
+    loop = asyncio.get_running_loop()
+    key = _host_key(url)
+    with _clients_lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(key)
+        if client is None:
+            client = httpx.AsyncClient(**_client_options())
+            clients[key] = client
+    return client
+
+
+async def async_http_get(url, headers=None, params=None):
+    """GET url through the pooled async client for its host"""
+    return await get_async_http_client(url).get(url, headers=headers, params=params)
+
+
+async def async_http_post(url, json=None, headers=None):
+    """POST a JSON body to url through the pooled async client for its host"""
+    return await get_async_http_client(url).post(url, json=json, headers=headers)
@@ -0,0 +1,147 @@
+# jobs.py
+"""
+In-process background jobs for webhook processing.
+
+Handlers running in async mode put their work on a bounded queue and return a
+job id straight away; a small pool of worker threads runs the existing
+pipelines. Pipelines report per-stage timings with ``stage_timer`` and produced
+gs:// paths with ``record_job_output``; both are no-ops outside a job.
+"""
+import contextlib
+import contextvars
+import datetime
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from CustomException import *
+
+ASYNC_WEBHOOKS = os.getenv("ASYNC_WEBHOOKS", "false").lower() in ("1", "true", "yes")
+JOB_QUEUE_SIZE = int(os.getenv("JOB_QUEUE_SIZE", "100"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+# Finished jobs are kept for status queries until this many newer jobs exist
+JOB_HISTORY_SIZE = int(os.getenv("JOB_HISTORY_SIZE", "1000"))
+
+_job_queue = queue.Queue(maxsize=JOB_QUEUE_SIZE)
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_workers = []
+_workers_lock = threading.Lock()
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+
+def _now():
+    return datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+
+def _start_workers():
+    """Start the worker pool on first use"""
+    with _workers_lock:
+        if _workers:
+            return
+        for i in range(JOB_WORKERS):
+            worker = threading.Thread(target=_run_worker, name=f"job-worker-{i}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _run_worker():
+    while True:
+        job, func, args, kwargs = _job_queue.get()
+        token = _current_job.set(job)
+        started = time.perf_counter()
+        with _jobs_lock:
+            job["status"] = "running"
+            job["started_at"] = _now()
+        try:
+            body, status_code = func(*args, **kwargs)
+            with _jobs_lock:
+                job["result"] = body
+                job["status_code"] = status_code
+                job["status"] = "succeeded" if status_code < 400 else "failed"
+        except Exception as e:
+            with _jobs_lock:
+                job["error"] = f"Unexpected error: {str(e)}"
+                job["status_code"] = 500
+                job["status"] = "failed"
+        finally:
+            _current_job.reset(token)
+            with _jobs_lock:
+                job["finished_at"] = _now()
+                job["duration_seconds"] = round(time.perf_counter() - started, 3)
+            _job_queue.task_done()
+
+
+def submit_job(kind, func, *args, **kwargs):
+    """Queue func(*args, **kwargs) to run on a worker and return the job id.
+
+    func must return a (body, status_code) tuple, like the webhook handlers'
+    processing functions. Raises JobQueueFullError when the queue is full.
+    """
+    _start_workers()
+
+    job = {
+        "id": uuid.uuid4().hex,
+        "kind": kind,
+        "status": "queued",
+        "created_at": _now(),
+        "started_at": None,
+        "finished_at": None,
+        "duration_seconds": None,
+        "stages": [],
+        "gcs_paths": [],
+        "result": None,
+        "status_code": None,
+        "error": None,
+    }
+
+    with _jobs_lock:
+        try:
+            _job_queue.put_nowait((job, func, args, kwargs))
+        except queue.Full:
+            raise JobQueueFullError(f"Job queue is full ({JOB_QUEUE_SIZE} jobs waiting)")
+
+        _jobs[job["id"]] = job
+        while len(_jobs) > JOB_HISTORY_SIZE:
+            oldest_id = next(iter(_jobs))
+            if _jobs[oldest_id]["status"] in ("queued", "running"):
+                break
+            _jobs.pop(oldest_id)
+
+    return job["id"]
+
+
+def get_job(job_id):
+    """Return a snapshot of a job's state, or None if it is unknown"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        if job is None:
+            return None
+        snapshot = dict(job)
+        snapshot["stages"] = list(job["stages"])
+        snapshot["gcs_paths"] = list(job["gcs_paths"])
+        return snapshot
+
+
+@contextlib.contextmanager
+def stage_timer(stage, **labels):
+    """Record how long the wrapped block took against the current job"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        job = _current_job.get()
+        if job is not None:
+            entry = {"stage": stage, **labels, "seconds": round(time.perf_counter() - started, 3)}
+            with _jobs_lock:
+                job["stages"].append(entry)
+
+
+def record_job_output(gcs_path):
+    """Attach a produced gs:// path to the current job"""
+    job = _current_job.get()
+    if job is not None and gcs_path:
+        with _jobs_lock:
+            job["gcs_paths"].append(gcs_path)
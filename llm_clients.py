@@ -0,0 +1,85 @@
+# llm_clients.py
+"""
+Process-wide registry of ChatGroq models and prompt chains.
+
+Building a ChatGroq creates fresh Groq SDK clients, so doing it per call paid
+for client setup and a new TLS handshake every time. Models are built once
+per (model, temperature) and keep their pooled connections, and chains are
+compiled once per (prompt, model, temperature).
+"""
+import os
+import threading
+from dotenv import load_dotenv
+from langchain.prompts import PromptTemplate
+from langchain_groq import ChatGroq
+
+load_dotenv()
+
+GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+
+# Model used to write commit documentation and release notes
+DOCUMENTATION_MODEL = os.getenv("DOCUMENTATION_MODEL", "llama-3.3-70b-versatile")
+# Smaller, faster model used for summaries
+SUMMARY_MODEL = os.getenv("SUMMARY_MODEL", "llama-3.1-8b-instant")
+
+# Context window, in tokens, of the Groq models these may be set to
+MODEL_CONTEXT_WINDOWS = {
+    "llama-3.3-70b-versatile": 131072,
+    "llama-3.1-8b-instant": 131072,
+    "meta-llama/llama-4-scout-17b-16e-instruct": 131072,
+    "meta-llama/llama-4-maverick-17b-128e-instruct": 131072,
+    "deepseek-r1-distill-llama-70b": 131072,
+    "qwen/qwen3-32b": 131072,
+    "openai/gpt-oss-120b": 131072,
+    "openai/gpt-oss-20b": 131072,
+    "mixtral-8x7b-32768": 32768,
+    "llama3-70b-8192": 8192,
+    "llama3-8b-8192": 8192,
+    "gemma2-9b-it": 8192,
+}
+# Assumed for models missing from the table
+DEFAULT_CONTEXT_WINDOW = int(os.getenv("DEFAULT_CONTEXT_WINDOW", "8192"))
+
+_models = {}
+_chains = {}
+_lock = threading.Lock()
+
+
+def get_llm(model_name, temperature):
+    """Return the shared ChatGroq for model_name at temperature"""
+    key = (model_name, temperature)
+    llm = _models.get(key)
+    if llm is None:
+        with _lock:
+            llm = _models.get(key)
+            if llm is None:
+                llm = ChatGroq(
+                    groq_api_key=GROQ_API_KEY,
+                    model_name=model_name,
+                    temperature=temperature,
+                    request_timeout=LLM_TIMEOUT,
+                    max_retries=LLM_MAX_RETRIES,
+                )
+                _models[key] = llm
+    return llm
+
+
+def get_chain(prompt_text, model_name, temperature):
+    """Return the compiled ``prompt | llm`` chain for prompt_text on the shared model"""
+    key = (prompt_text, model_name, temperature)
+    chain = _chains.get(key)
+    if chain is None:
+        llm = get_llm(model_name, temperature)
+        with _lock:
+            chain = _chains.get(key)
+            if chain is None:
+                chain = PromptTemplate.from_template(prompt_text) | llm
+                _chains[key] = chain
+    return chain
+
+
+def get_context_window(model_name):
+    """Context window of model_name in tokens"""
+    return MODEL_CONTEXT_WINDOWS.get(model_name, DEFAULT_CONTEXT_WINDOW)
@@ -0,0 +1,119 @@
+# migrate_commit_docs.py
+"""
+Move commit docs from the legacy ``{branch}/commits/{timestamp}_{repo}_{sha}.txt``
+layout into the content-addressed ``{repo}/by-sha/{sha[:2]}/{sha}`` layout.
+
+Each blob is copied first, then its index marker is pointed at the copy, and
+only then (with --delete-source) is the original removed, so readers keep
+finding every doc while the migration runs. Progress is checkpointed to a
+local file and copies are create-only, so an interrupted run can be restarted
+with the same command.
+
+    python migrate_commit_docs.py <bucket_name> [--delete-source] [--dry-run]
+"""
+import argparse
+import os
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from commit_index import (
+    INDEX_PREFIX,
+    LEGACY_DOC_PATTERN,
+    commit_doc_blob_name,
+    get_storage_client,
+    lookup_commit_doc,
+    record_commit_doc,
+)
+
+CHECKPOINT_EVERY = 100
+
+
+def read_checkpoint(checkpoint_path):
+    """Return the last migrated blob name, or None for a fresh run"""
+    if not os.path.exists(checkpoint_path):
+        return None
+    with open(checkpoint_path) as f:
+        return f.read().strip() or None
+
+
+def write_checkpoint(checkpoint_path, blob_name):
+    with open(checkpoint_path, "w") as f:
+        f.write(blob_name)
+
+
+def migrate_blob(bucket, blob, delete_source=False, dry_run=False):
+    """Migrate one legacy blob. Returns True if a copy was made."""
+    match = LEGACY_DOC_PATTERN.match(blob.name)
+    repo_name, commit_sha = match.group("repo"), match.group("sha")
+    target_name = commit_doc_blob_name(repo_name, commit_sha)
+
+    if dry_run:
+        print(f"Would migrate {blob.name} -> {target_name}")
+        return True
+
+    copied = False
+    try:
+        # Create-only copy: an existing target (newer write or earlier run) wins
+        target = bucket.copy_blob(blob, bucket, target_name, if_generation_match=0)
+        target.metadata = {**(blob.metadata or {}), "branch": match.group("branch")}
+        target.patch()
+        copied = True
+    except PreconditionFailed:
+        pass
+
+    if lookup_commit_doc(bucket.name, repo_name, commit_sha) != target_name:
+        record_commit_doc(bucket.name, repo_name, commit_sha, target_name)
+
+    if delete_source:
+        try:
+            blob.delete()
+        except NotFound:
+            pass
+
+    return copied
+
+
+def migrate_commit_docs(bucket_name, checkpoint_path, delete_source=False, dry_run=False):
+    """Walk the bucket from the last checkpoint and migrate every legacy doc"""
+    bucket = get_storage_client().bucket(bucket_name)
+    start_after = read_checkpoint(checkpoint_path)
+    if start_after:
+        print(f"Resuming after {start_after}")
+
+    seen = copied = 0
+    for blob in bucket.list_blobs(start_offset=start_after):
+        if blob.name == start_after or blob.name.startswith(f"{INDEX_PREFIX}/"):
+            continue
+        if not LEGACY_DOC_PATTERN.match(blob.name):
+            continue
+
+        if migrate_blob(bucket, blob, delete_source=delete_source, dry_run=dry_run):
+            copied += 1
+        seen += 1
+
+        if not dry_run and seen % CHECKPOINT_EVERY == 0:
+            write_checkpoint(checkpoint_path, blob.name)
+            print(f"Migrated {seen} docs ({copied} copied), last: {blob.name}")
+
+    if not dry_run and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+
+    print(f"Migration of {bucket_name} finished: {seen} legacy docs, {copied} copied")
+    return seen, copied
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move commit docs into the content-addressed layout")
+    parser.add_argument("bucket_name")
+    parser.add_argument("--delete-source", action="store_true",
+                        help="remove each legacy blob once its copy is indexed")
+    parser.add_argument("--dry-run", action="store_true",
+                        help="only print what would be migrated")
+    parser.add_argument("--checkpoint", default=None,
+                        help="checkpoint file (default: .migrate_commit_docs_<bucket>)")
+    args = parser.parse_args()
+
+    migrate_commit_docs(
+        args.bucket_name,
+        args.checkpoint or f".migrate_commit_docs_{args.bucket_name}",
+        delete_source=args.delete_source,
+        dry_run=args.dry_run,
+    )
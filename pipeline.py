@@ -0,0 +1,64 @@
+# pipeline.py
+"""
+Minimal stage graph for the analyzer pipelines.
+
+A pipeline is a dict of ``name -> (dependencies, stage)`` where ``stage`` is an
+async function that receives the results of the stages finished so far. Every
+stage starts as soon as its dependencies are done, so independent stages
+overlap, and each one is timed through ``jobs.stage_timer``.
+"""
+import asyncio
+import time
+from jobs import stage_timer
+
+
+async def run_stage_graph(stages, **labels):
+    """Run the stages of a pipeline and return {stage name: result}.
+
+    labels (e.g. commit=sha) are attached to the recorded stage timings. If a
+    stage raises, the stages still running are cancelled and the error is
+    re-raised.
+    """
+    for name, (dependencies, _) in stages.items():
+        unknown = [dependency for dependency in dependencies if dependency not in stages]
+        if unknown:
+            raise ValueError(f"Stage {name} depends on unknown stages: {unknown}")
+
+    # A cycle would leave its stages waiting on each other forever
+    resolved = set()
+    remaining = dict(stages)
+    while remaining:
+        ready = [name for name, (dependencies, _) in remaining.items() if set(dependencies) <= resolved]
+        if not ready:
+            raise ValueError(f"Stage graph has a cycle between: {sorted(remaining)}")
+        for name in ready:
+            resolved.add(name)
+            remaining.pop(name)
+
+    results = {}
+    timings = {}
+    tasks = {}
+
+    async def run(name):
+        dependencies, stage = stages[name]
+        if dependencies:
+            await asyncio.gather(*(tasks[dependency] for dependency in dependencies))
+
+        started = time.perf_counter()
+        with stage_timer(name, **labels):
+            results[name] = await stage(results)
+        timings[name] = round(time.perf_counter() - started, 3)
+
+    # All tasks exist before any of them runs, so dependencies can be awaited by name
+    for name in stages:
+        tasks[name] = asyncio.ensure_future(run(name))
+
+    try:
+        await asyncio.gather(*tasks.values())
+    except BaseException:
+        for task in tasks.values():
+            task.cancel()
+        raise
+
+    print(f"Stage timings {labels}: {timings}")
+    return results
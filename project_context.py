@@ -0,0 +1,207 @@
+# project_context.py
+"""
+Cached project context (the summarized README) per repository.
+
+A README almost never changes between pushes, so its LLM summary is cached
+together with the README's content SHA. A cached entry is revalidated with one
+conditional request: ``If-None-Match`` with the stored ETag against GitHub's
+README endpoint, a HEAD on the GitLab files API compared against
+``X-Gitlab-Content-Sha256``. Only a README that actually changed is downloaded
+and summarized again, and a repository without a README is remembered for
+NO_README_RECHECK_SECONDS instead of being looked up on every push.
+
+Entries live in an in-memory LRU and, when PROJECT_CONTEXT_CACHE_BUCKET is set,
+also in GCS so that new instances start warm.
+"""
+import asyncio
+import base64
+import json
+import os
+import time
+from urllib.parse import quote
+import httpx
+from google.api_core.exceptions import NotFound
+from cache import LRUCache
+from commit_index import get_storage_client
+from token_budget import COMMIT_PROMPT_SHARES, section_budget
+from http_clients import async_http_get, get_async_http_client
+from utils import (
+    GITHUB_TOKEN,
+    GITLAB_API_URL,
+    GITLAB_TOKEN,
+    find_repository_readme_github,
+    find_repository_readme_gitlab,
+    summarize_with_llm_async,
+)
+
+PROJECT_CONTEXT_CACHE_SIZE = int(os.getenv("PROJECT_CONTEXT_CACHE_SIZE", "256"))
+PROJECT_CONTEXT_CACHE_BUCKET = os.getenv("PROJECT_CONTEXT_CACHE_BUCKET")
+CACHE_PREFIX = "_cache/project-context"
+
+# How long a repository without a README is remembered before it is looked up again
+NO_README_RECHECK_SECONDS = int(os.getenv("NO_README_RECHECK_SECONDS", "3600"))
+
+NO_README = "No README found"
+
+# A README that fits in the prompt's project context share is used as is, without an LLM call
+README_TOKEN_BUDGET = section_budget(COMMIT_PROMPT_SHARES, "project_context")
+
+_project_contexts = LRUCache(PROJECT_CONTEXT_CACHE_SIZE)
+
+
+def _load_persisted(cache_key):
+    try:
+        blob = get_storage_client().bucket(PROJECT_CONTEXT_CACHE_BUCKET).blob(f"{CACHE_PREFIX}/{cache_key}.json")
+        return json.loads(blob.download_as_text())
+    except NotFound:
+        return None
+    except Exception as e:
+        print(f"Warning: Could not read cached project context for {cache_key}: {str(e)}")
+        return None
+
+
+def _save_persisted(cache_key, entry):
+    try:
+        blob = get_storage_client().bucket(PROJECT_CONTEXT_CACHE_BUCKET).blob(f"{CACHE_PREFIX}/{cache_key}.json")
+        blob.upload_from_string(json.dumps(entry), content_type="application/json")
+    except Exception as e:
+        print(f"Warning: Could not persist project context for {cache_key}: {str(e)}")
+
+
+async def _get_entry(cache_key):
+    entry = _project_contexts.get(cache_key)
+    if entry is None and PROJECT_CONTEXT_CACHE_BUCKET:
+        entry = await asyncio.to_thread(_load_persisted, cache_key)
+        if entry:
+            _project_contexts.put(cache_key, entry)
+    return entry
+
+
+async def _store_entry(cache_key, entry):
+    _project_contexts.put(cache_key, entry)
+    if PROJECT_CONTEXT_CACHE_BUCKET:
+        await asyncio.to_thread(_save_persisted, cache_key, entry)
+
+
+def _known_missing(entry):
+    """True while a cached "no README" result is still fresh"""
+    return time.time() - entry.get("checked_at", 0) < NO_README_RECHECK_SECONDS
+
+
+async def _store_missing(cache_key):
+    await _store_entry(cache_key, {"missing": True, "checked_at": time.time()})
+    return NO_README
+
+
+async def get_project_context_github(GITHUB_OWNER, GITHUB_REPO):
+    """Return the summarized README of a GitHub repository, reusing the cached summary while the README is unchanged"""
+    cache_key = f"github/{GITHUB_OWNER}/{GITHUB_REPO}"
+    entry = await _get_entry(cache_key)
+    readme = None
+
+    if entry and entry.get("missing"):
+        if _known_missing(entry):
+            return NO_README
+        entry = None
+
+    if entry:
+        headers = {"Authorization": f"token {GITHUB_TOKEN}"}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        url = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}/readme"
+
+        try:
+            response = await async_http_get(url, headers=headers)
+        except httpx.HTTPError as e:
+            # A stale summary is better than none
+            print(f"Warning: Could not revalidate README for {GITHUB_OWNER}/{GITHUB_REPO}: {str(e)}")
+            return entry["summary"]
+
+        if response.status_code == 304:
+            return entry["summary"]
+        if response.status_code == 404:
+            return await _store_missing(cache_key)
+        if response.status_code != 200:
+            print(f"Warning: Could not revalidate README for {GITHUB_OWNER}/{GITHUB_REPO}: HTTP {response.status_code}")
+            return entry["summary"]
+
+        data = response.json()
+        if data.get("sha") == entry.get("sha"):
+            await _store_entry(cache_key, {**entry, "path": data.get("path", entry["path"]), "etag": response.headers.get("ETag")})
+            return entry["summary"]
+        if not data.get("content"):
+            return await _store_missing(cache_key)
+        readme = {
+            "path": data.get("path"),
+            "sha": data.get("sha"),
+            "etag": response.headers.get("ETag"),
+            "content": base64.b64decode(data["content"]).decode('utf-8'),
+        }
+    else:
+        try:
+            readme = await find_repository_readme_github(GITHUB_OWNER, GITHUB_REPO)
+        except httpx.HTTPError as e:
+            # Not cached: a failed lookup says nothing about whether a README exists
+            print(f"Warning: Could not fetch README for {GITHUB_OWNER}/{GITHUB_REPO}: {str(e)}")
+            return NO_README
+        if readme is None:
+            return await _store_missing(cache_key)
+
+    summary = await summarize_with_llm_async(readme["content"], "readme", max_tokens=README_TOKEN_BUDGET)
+    await _store_entry(cache_key, {
+        "path": readme["path"],
+        "sha": readme["sha"],
+        "etag": readme["etag"],
+        "summary": summary,
+    })
+    return summary
+
+
+async def get_project_context_gitlab(project_id):
+    """Return the summarized README of a GitLab project, reusing the cached summary while the README is unchanged"""
+    cache_key = f"gitlab/{project_id}"
+    entry = await _get_entry(cache_key)
+
+    if entry and entry.get("missing"):
+        if _known_missing(entry):
+            return NO_README
+        entry = None
+
+    if entry:
+        headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
+        url = f"{GITLAB_API_URL}/projects/{project_id}/repository/files/{quote(entry['path'], safe='')}"
+
+        try:
+            response = await get_async_http_client(url).head(url, headers=headers, params={"ref": entry.get("ref", "HEAD")})
+        except httpx.HTTPError as e:
+            # A stale summary is better than none
+            print(f"Warning: Could not revalidate README for project {project_id}: {str(e)}")
+            return entry["summary"]
+
+        if response.status_code == 200 and response.headers.get("X-Gitlab-Content-Sha256") == entry.get("content_sha256"):
+            return entry["summary"]
+
+    try:
+        readme = await find_repository_readme_gitlab(project_id)
+    except httpx.HTTPError as e:
+        print(f"Warning: Could not fetch README for project {project_id}: {str(e)}")
+        return entry["summary"] if entry else NO_README
+    if readme is None:
+        return await _store_missing(cache_key)
+    if entry and readme["content_sha256"] == entry.get("content_sha256"):
+        await _store_entry(cache_key, {**entry, "path": readme["path"], "ref": readme["ref"]})
+        return entry["summary"]
+
+    summary = await summarize_with_llm_async(readme["content"], "readme", max_tokens=README_TOKEN_BUDGET)
+    await _store_entry(cache_key, {
+        "path": readme["path"],
+        "ref": readme["ref"],
+        "content_sha256": readme["content_sha256"],
+        "summary": summary,
+    })
+    return summary
+
+
+def get_project_context_cache_stats():
+    """Hit/miss counters of the in-memory project context cache"""
+    return _project_contexts.stats()
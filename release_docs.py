@@ -0,0 +1,118 @@
+# release_docs.py
+"""
+Commit documentation for release notes.
+
+The analyzers walk a release's commit range page by page. Once every page
+is in, the release's shas are resolved in one lookup_commit_docs call, so a
+large release lists the commit index prefix once rather than once per page.
+Docs are downloaded and summarized concurrently, at most
+RELEASE_DOC_CONCURRENCY at a time per release, and they come back in commit
+order.
+
+The release prompt's commit_docs budget is split between the docs that were
+found, once every page is in: undocumented and merge commits take no share,
+room a short doc doesn't need goes to the longer ones, and only docs over
+their allowance are summarized. A release with more docs than the budget can
+give MIN_ITEM_TOKENS each has neighbouring docs summarized together.
+"""
+import asyncio
+import os
+from CustomException import *
+from commit_index import get_storage_client, lookup_commit_docs
+from token_budget import RELEASE_PROMPT_SHARES, allocate, count_tokens, merge_to_floor, section_budget
+from utils import summarize_with_llm_async
+
+# Commit docs downloaded or summarized at the same time for one release
+RELEASE_DOC_CONCURRENCY = max(1, int(os.getenv("RELEASE_DOC_CONCURRENCY", "8")))
+
+
+def resolve_commit_documentation(bucket_name, repo_name, commit_shas):
+    """Map each documented commit sha to its documentation blob name"""
+    if not bucket_name:
+        raise GoogleCloudStorageError("No commit documentation bucket specified")
+
+    try:
+        return lookup_commit_docs(bucket_name, repo_name, commit_shas)
+    except GoogleCloudStorageError:
+        raise
+    except Exception as e:
+        raise GoogleCloudStorageError(f"Error finding commit documentation: {str(e)}")
+
+
+def download_commit_doc(bucket_name, blob_name):
+    """Text of a commit doc, or None if it no longer exists"""
+    if not bucket_name or not blob_name:
+        raise GoogleCloudStorageError("Missing bucket name or blob name")
+
+    try:
+        blob = get_storage_client().bucket(bucket_name).blob(blob_name)
+        if not blob.exists():
+            return None
+        with blob.open("r") as f:
+            return f.read()
+    except Exception as e:
+        raise GoogleCloudStorageError(f"Error reading file from GCS: {str(e)}")
+
+
+async def collect_commit_docs(bucket_name, repo_name, commit_pages, sha_key="sha"):
+    """Read the documentation of the commits yielded by commit_pages.
+
+    commit_pages is an async iterator of pages of commits. Returns
+    [{"documentation": text}] in commit order; commits without documentation
+    are skipped.
+    """
+    commit_docs_tokens = section_budget(RELEASE_PROMPT_SHARES, "commit_docs")
+    # Shared by the downloads and the summaries, so one release never has
+    # more than RELEASE_DOC_CONCURRENCY of them in flight
+    semaphore = asyncio.Semaphore(RELEASE_DOC_CONCURRENCY)
+
+    async def download(commit_sha, doc_path):
+        try:
+            # GCS calls are blocking, keep them off the event loop
+            async with semaphore:
+                return await asyncio.to_thread(download_commit_doc, bucket_name, doc_path)
+        except Exception as e:
+            # Log but continue processing other commits
+            print(f"Warning: Could not read documentation for commit {commit_sha}: {str(e)}")
+            return None
+
+    async def summarize(commit_shas, content, max_tokens):
+        try:
+            async with semaphore:
+                return {
+                    'documentation': await summarize_with_llm_async(content, "documentation", max_tokens=max_tokens),
+                }
+        except Exception as e:
+            print(f"Warning: Could not summarize documentation for commits {commit_shas}: {str(e)}")
+            return None
+
+    release_shas = []
+    async for commits in commit_pages:
+        release_shas.extend(commit[sha_key] for commit in commits)
+
+    try:
+        doc_paths = await asyncio.to_thread(resolve_commit_documentation, bucket_name, repo_name, release_shas)
+    except GoogleCloudStorageError as e:
+        # The note is still written from the release metadata
+        print(f"Warning: Could not resolve documentation for {len(release_shas)} commits: {str(e)}")
+        doc_paths = {}
+
+    documented = [commit_sha for commit_sha in release_shas if doc_paths.get(commit_sha)]
+    contents = await asyncio.gather(*(download(commit_sha, doc_paths[commit_sha]) for commit_sha in documented))
+
+    docs = {commit_sha: content for commit_sha, content in zip(documented, contents) if content is not None}
+    # Too many docs to give each MIN_ITEM_TOKENS are merged with their
+    # neighbours, so groups of commits are summarized together
+    docs = list(merge_to_floor(docs, commit_docs_tokens).items())
+    # The budget is split over the docs that were actually found, and room a
+    # short doc doesn't need goes to the longer ones
+    allowances = allocate(
+        {index: count_tokens(content) for index, (_, content) in enumerate(docs)},
+        {index: 1 for index in range(len(docs))},
+        commit_docs_tokens,
+    )
+    # gather keeps the docs in commit order whatever order they finish in
+    summaries = await asyncio.gather(*(
+        summarize(commit_shas, content, allowances[index]) for index, (commit_shas, content) in enumerate(docs)
+    ))
+    return [summary for summary in summaries if summary is not None]
@@ -0,0 +1,128 @@
+# release_index.py
+"""
+Release tag ordering per repository.
+
+Finding the release before a tag used to mean listing the repository's
+releases on every release event (only the first page of them) and sorting
+the list. Each repository's tags are now held in memory in release date
+order. The index is backfilled once through the provider's paginated
+releases API, release webhooks add and remove tags as they happen, and the
+previous tag is found with a bisect.
+
+An index is rebuilt after RELEASE_INDEX_TTL_SECONDS, or when it is asked
+about a tag it has never seen, so releases handled by other instances are
+picked up as well.
+"""
+import bisect
+import datetime
+import os
+import threading
+import time
+from cache import LRUCache
+
+RELEASE_INDEX_SIZE = int(os.getenv("RELEASE_INDEX_SIZE", "256"))
+RELEASE_INDEX_TTL_SECONDS = int(os.getenv("RELEASE_INDEX_TTL_SECONDS", "3600"))
+
+_release_indexes = LRUCache(RELEASE_INDEX_SIZE)
+
+
+def github_repo_key(repo_owner, repo_name):
+    return f"github/{repo_owner}/{repo_name}"
+
+
+def gitlab_project_key(project_id):
+    return f"gitlab/{project_id}"
+
+
+def _timestamp(released_at):
+    try:
+        return datetime.datetime.fromisoformat(released_at.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class ReleaseIndex:
+    """Tags of one repository in release date order"""
+
+    def __init__(self, releases=()):
+        self.loaded_at = time.time()
+        # (timestamp, tag) pairs kept sorted, and each tag's timestamp
+        self._order = []
+        self._timestamps = {}
+        self._lock = threading.Lock()
+        for tag, released_at in releases:
+            self.add(tag, released_at)
+
+    def add(self, tag, released_at):
+        """Insert a tag, or move it if its release date changed"""
+        timestamp = _timestamp(released_at)
+        if timestamp is None:
+            print(f"Warning: Ignoring release {tag} with invalid date {released_at!r}")
+            return
+        with self._lock:
+            self._discard(tag)
+            bisect.insort(self._order, (timestamp, tag))
+            self._timestamps[tag] = timestamp
+
+    def remove(self, tag):
+        with self._lock:
+            self._discard(tag)
+
+    def _discard(self, tag):
+        timestamp = self._timestamps.pop(tag, None)
+        if timestamp is not None:
+            del self._order[bisect.bisect_left(self._order, (timestamp, tag))]
+
+    def previous(self, tag):
+        """Tag released just before tag, or None if it is the first; KeyError if tag is unknown"""
+        with self._lock:
+            position = bisect.bisect_left(self._order, (self._timestamps[tag], tag))
+            return self._order[position - 1][1] if position else None
+
+    def expired(self):
+        return time.time() - self.loaded_at > RELEASE_INDEX_TTL_SECONDS
+
+    def __contains__(self, tag):
+        with self._lock:
+            return tag in self._timestamps
+
+    def __len__(self):
+        with self._lock:
+            return len(self._order)
+
+
+async def previous_release_tag(repo_key, release_tag, list_releases):
+    """Tag released before release_tag, or None for a first release.
+
+    list_releases is an async callable returning every release of the
+    repository as (tag, released_at) pairs; it is only called to build or
+    refresh the index.
+    """
+    index = _release_indexes.get(repo_key)
+    if index is None or index.expired() or release_tag not in index:
+        index = ReleaseIndex(await list_releases())
+        _release_indexes.put(repo_key, index)
+        print(f"Indexed {len(index)} releases of {repo_key}")
+
+    try:
+        return index.previous(release_tag)
+    except KeyError:
+        return None
+
+
+def record_release(repo_key, release_tag, released_at):
+    """Add a release announced by a webhook to its repository's index, if one is loaded"""
+    index = _release_indexes.get(repo_key)
+    if index is not None and released_at:
+        index.add(release_tag, released_at)
+
+
+def forget_release(repo_key, release_tag):
+    """Drop a deleted release from its repository's index, if one is loaded"""
+    index = _release_indexes.get(repo_key)
+    if index is not None:
+        index.remove(release_tag)
+
+
+def get_release_index_stats():
+    return _release_indexes.stats()
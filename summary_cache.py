@@ -0,0 +1,123 @@
+# summary_cache.py
+"""
+Memoized LLM summaries keyed by (content hash, content_type, model).
+
+The same commit doc is summarized again for every later commit touching the
+same file and on every release rerun. Summaries are looked up in an
+in-memory LRU first, then in a persistent tier: a local directory when
+SUMMARY_CACHE_DIR is set, and/or GCS when SUMMARY_CACHE_BUCKET is set.
+A hit in either tier skips the LLM entirely.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+from google.api_core.exceptions import NotFound
+from cache import LRUCache
+from commit_index import get_storage_client
+
+SUMMARY_CACHE_SIZE = int(os.getenv("SUMMARY_CACHE_SIZE", "2048"))
+SUMMARY_CACHE_BUCKET = os.getenv("SUMMARY_CACHE_BUCKET")
+SUMMARY_CACHE_DIR = os.getenv("SUMMARY_CACHE_DIR")
+CACHE_PREFIX = "_cache/summaries"
+
+_summaries = LRUCache(SUMMARY_CACHE_SIZE)
+_counters = {"persistent_hits": 0, "llm_calls": 0}
+_counters_lock = threading.Lock()
+
+
+def summary_cache_key(text, content_type, model_name):
+    """Stable cache key for a summary of text"""
+    content_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    return f"{model_name}/{content_type}/{content_hash}"
+
+
+def _count(counter):
+    with _counters_lock:
+        _counters[counter] += 1
+
+
+def _disk_path(key):
+    return os.path.join(SUMMARY_CACHE_DIR, *key.split("/")) + ".txt"
+
+
+def _load_persisted(key):
+    if SUMMARY_CACHE_DIR:
+        try:
+            with open(_disk_path(key), encoding="utf-8") as f:
+                return f.read()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Warning: Could not read cached summary {key}: {str(e)}")
+
+    if SUMMARY_CACHE_BUCKET:
+        try:
+            blob = get_storage_client().bucket(SUMMARY_CACHE_BUCKET).blob(f"{CACHE_PREFIX}/{key}.txt")
+            summary = blob.download_as_text()
+        except NotFound:
+            return None
+        except Exception as e:
+            print(f"Warning: Could not read cached summary {key}: {str(e)}")
+            return None
+        # Keep a local copy so the next lookup on this instance stays off the network
+        if SUMMARY_CACHE_DIR:
+            _save_to_disk(key, summary)
+        return summary
+
+    return None
+
+
+def _save_to_disk(key, summary):
+    path = _disk_path(key)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Write then rename so concurrent readers never see a partial file
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(summary)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"Warning: Could not write cached summary {key}: {str(e)}")
+
+
+def _save_persisted(key, summary):
+    if SUMMARY_CACHE_DIR:
+        _save_to_disk(key, summary)
+
+    if SUMMARY_CACHE_BUCKET:
+        try:
+            blob = get_storage_client().bucket(SUMMARY_CACHE_BUCKET).blob(f"{CACHE_PREFIX}/{key}.txt")
+            blob.upload_from_string(summary, content_type="text/plain; charset=utf-8")
+        except Exception as e:
+            print(f"Warning: Could not persist summary {key}: {str(e)}")
+
+
+async def get_cached_summary(key):
+    """Return the cached summary for key, or None"""
+    summary = _summaries.get(key)
+    if summary is not None:
+        return summary
+
+    if SUMMARY_CACHE_DIR or SUMMARY_CACHE_BUCKET:
+        summary = await asyncio.to_thread(_load_persisted, key)
+        if summary is not None:
+            _count("persistent_hits")
+            _summaries.put(key, summary)
+    return summary
+
+
+async def store_summary(key, summary):
+    """Cache a freshly generated summary in every configured tier"""
+    _count("llm_calls")
+    _summaries.put(key, summary)
+    if SUMMARY_CACHE_DIR or SUMMARY_CACHE_BUCKET:
+        await asyncio.to_thread(_save_persisted, key, summary)
+
+
+def get_summary_cache_stats():
+    """Hit/miss counters of the summary cache"""
+    stats = _summaries.stats()
+    with _counters_lock:
+        stats.update(_counters)
+    return stats
@@ -0,0 +1,190 @@
+# token_budget.py
+"""
+Token counting and prompt budget allocation.
+
+The documentation prompts are built from a few variable sections (project
+context, previous documentation, the diff, release commit docs). Each section
+gets a share of the documentation model's context window, less room for the
+instructions and the answer; a section is only summarized when it is over its
+share, and room a small section doesn't use goes to the others.
+
+Within a section every item (a commit's doc, a file's previous docs) gets at
+least MIN_ITEM_TOKENS. When there are too many items for that, neighbouring
+items are merged and summarized together instead of each being cut down to a
+few words.
+
+Tokens are counted with tiktoken when it is installed and estimated at four
+characters per token otherwise.
+"""
+import os
+import re
+from llm_clients import DOCUMENTATION_MODEL, get_context_window
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# Tokens of every prompt kept for the instructions and the model's answer
+PROMPT_RESERVED_TOKENS = int(os.getenv("PROMPT_RESERVED_TOKENS", "8000"))
+# Optional cap on the variable sections of a prompt, e.g. to stay under a
+# tokens-per-minute limit; 0 uses the whole context window
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "0"))
+# Fewest tokens an item of a section is summarized down to
+MIN_ITEM_TOKENS = int(os.getenv("MIN_ITEM_TOKENS", "200"))
+
+# Share of the budget each section may use before it is summarized or trimmed
+COMMIT_PROMPT_SHARES = {
+    "project_context": 0.15,
+    "previous_documentation": 0.35,
+    "diff": 0.50,
+}
+RELEASE_PROMPT_SHARES = {
+    "project_context": 0.15,
+    "commit_docs": 0.85,
+}
+
+TRUNCATION_MARKER = "\n\n[... truncated to fit the token budget ...]\n"
+
+# Where a summary can be cut without breaking a sentence
+SENTENCE_END = re.compile(r"[.!?:](?=\s)|\n")
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """Load the tiktoken encoding on first use, or None to estimate instead"""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        if tiktoken is not None:
+            try:
+                _encoding = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                # The encoding file is downloaded on first use and may be unreachable
+                print(f"Warning: Could not load tiktoken encoding, estimating tokens instead: {str(e)}")
+    return _encoding
+
+
+def count_tokens(text):
+    """Number of tokens in text"""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + 3) // 4
+
+
+def context_budget(model_name=DOCUMENTATION_MODEL):
+    """Tokens available to the variable sections of a prompt sent to model_name"""
+    window = get_context_window(model_name)
+    budget = window - min(PROMPT_RESERVED_TOKENS, window // 2)
+    if CONTEXT_TOKEN_BUDGET:
+        budget = min(budget, CONTEXT_TOKEN_BUDGET)
+    return budget
+
+
+def section_budget(shares, section, budget=None):
+    """Tokens reserved for one section before any rebalancing"""
+    budget = context_budget() if budget is None else budget
+    return int(budget * shares[section])
+
+
+def allocate(sizes, shares, budget=None):
+    """Split the budget between sections given their sizes in tokens.
+
+    Every section gets up to its share; what a section leaves unused is handed
+    to the sections that want more, in proportion to their shares. Returns
+    {section: allowed tokens}.
+    """
+    budget = context_budget() if budget is None else budget
+    allowances = {}
+    remaining = budget
+    wanting = dict(sizes)
+
+    # Sections that fit in their share take what they need; repeat until the
+    # rest all want more than an even split of what is left
+    while wanting:
+        total_share = sum(shares[section] for section in wanting)
+        fitting = {
+            section: size for section, size in wanting.items()
+            if size <= remaining * shares[section] / total_share
+        }
+        if not fitting:
+            break
+        for section, size in fitting.items():
+            allowances[section] = size
+            remaining -= size
+            del wanting[section]
+
+    total_share = sum(shares[section] for section in wanting)
+    for section in wanting:
+        allowances[section] = int(remaining * shares[section] / total_share)
+    return allowances
+
+
+def truncate_to_tokens(text, max_tokens):
+    """Cut text down to about max_tokens, marking where it was cut"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return encoding.decode(tokens[:max_tokens]) + TRUNCATION_MARKER
+    return text[:max_tokens * 4] + TRUNCATION_MARKER
+
+
+def trim_to_sentence(text, max_tokens):
+    """Cut text down to about max_tokens at the end of a sentence or line"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is not None:
+        cut = encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+    else:
+        cut = text[:max_tokens * 4]
+    ends = [match.end() for match in SENTENCE_END.finditer(cut)]
+    # Only back off to a sentence end that keeps most of the text
+    if ends and ends[-1] >= len(cut) // 2:
+        cut = cut[:ends[-1]]
+    return cut.rstrip()
+
+
+def merge_to_floor(items, budget, separator="\n\n---\n\n"):
+    """Merge neighbouring items of {label: text} until each gets MIN_ITEM_TOKENS of budget.
+
+    Items that fit in the budget together, or are few enough for the floor,
+    are returned as they are. Otherwise consecutive runs are joined into as
+    many groups as the floor allows, labelled with their items' labels, so
+    each group can be summarized as a whole. Order is kept.
+    """
+    groups = max(1, budget // MIN_ITEM_TOKENS)
+    if len(items) <= groups or sum(count_tokens(text) for text in items.values()) <= budget:
+        return dict(items)
+
+    print(f"Merging {len(items)} items into {groups} groups of at least {MIN_ITEM_TOKENS} tokens")
+    entries = list(items.items())
+    size, extra = divmod(len(entries), groups)
+    merged = {}
+    start = 0
+    for group in range(groups):
+        end = start + size + (1 if group < extra else 0)
+        run = entries[start:end]
+        merged[", ".join(label for label, _ in run)] = separator.join(text for _, text in run)
+        start = end
+    return merged
+
+
+def fit_sections(sections, shares, budget=None):
+    """Trim each section of {name: text} to its allocation of the budget"""
+    sizes = {name: count_tokens(text) for name, text in sections.items()}
+    allowances = allocate(sizes, shares, budget)
+    fitted = {}
+    for name, text in sections.items():
+        if sizes[name] > allowances[name]:
+            print(f"Trimming {name} from {sizes[name]} to {allowances[name]} tokens")
+            text = truncate_to_tokens(text, allowances[name])
+        fitted[name] = text
+    return fitted
@@ -1,49 +1,62 @@
 # utils.py with GitLab additions
-from langchain_groq import ChatGroq
-from langchain.prompts import PromptTemplate
 import os
 from dotenv import load_dotenv
 from httpx import Client
-import requests
+import httpx
 from dotenv import load_dotenv
 import base64
+import asyncio
+import hashlib
+from urllib.parse import quote
+from http_clients import async_http_get
+from llm_clients import SUMMARY_MODEL, get_chain
+from token_budget import context_budget, count_tokens, trim_to_sentence, truncate_to_tokens
+from summary_cache import get_cached_summary, store_summary, summary_cache_key
 
 load_dotenv()
 
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 GITHUB_TOKEN = os.getenv("GITHUB_TOKEN")
 GITLAB_TOKEN = os.getenv("GITLAB_TOKEN")
+# REST API of the GitLab instance the webhooks come from
+GITLAB_API_URL = os.getenv("GITLAB_API_URL", "https://gitlab.kazan.myworldline.com/api/v4").rstrip("/")
 
-async def summarize_with_llm_async(text, content_type="documentation", max_length=300):
-    """Use LLM to intelligently summarize any text"""
-    if not text or len(text) < max_length:
+async def summarize_with_llm_async(text, content_type="documentation", max_length=300, max_tokens=None):
+    """Use LLM to intelligently summarize any text.
+
+    With max_tokens, text that already fits in that many tokens is returned
+    as is, and otherwise the model is asked for a summary of about that
+    length; one that still runs over is cut at a sentence end. Without it,
+    any text of max_length characters or more is summarized in under 500 words.
+    """
+    if max_tokens is not None:
+        if count_tokens(text) <= max_tokens:
+            return text
+        # About three words per four tokens, with some slack for the model overshooting
+        max_words = max(20, max_tokens * 2 // 3)
+    elif not text or len(text) < max_length:
         return text
-    
-    # Use a faster/smaller model for summarization if available
-    summarizer_llm = ChatGroq(
-        groq_api_key=GROQ_API_KEY,
-        model_name="llama-3.1-8b-instant",  # Smaller model for summarization
-        temperature=0.1
-    )
+    else:
+        max_words = 500
     
     # Different prompts for different content types
     prompts = {
         "readme": """Summarize this project README to capture the essential purpose, 
-                    features and structure of the project in under 500 words:
+                    features and structure of the project in under {max_words} words:
                     
                     {text}
                     
                     SUMMARY:""",
                     
         "file_history": """Summarize the history of file changes below to highlight patterns 
-                          and significant modifications in under 500 words:
+                          and significant modifications in under {max_words} words:
                           
                           {text}
                           
                           SUMMARY:""",
                           
         "documentation": """Summarize this previous documentation to highlight the most relevant 
-                           information for understanding code changes in under 500 words:
+                           information for understanding code changes in under {max_words} words:
                            
                            {text}
                            
@@ -51,55 +64,89 @@ async def summarize_with_llm_async(text, content_type="documentation", max_lengt
                            SUMMARY:"""
     }
     
-    prompt_template = PromptTemplate(
-        input_variables=["text"],
-        template=prompts.get(content_type, prompts["documentation"])
-    )
-    
-    chain = prompt_template | summarizer_llm
+    if content_type not in prompts:
+        content_type = "documentation"
+
+    # The same text at the same length always gets the same summary, so reuse earlier ones
+    cache_key = summary_cache_key(text, f"{content_type}-{max_words}w", SUMMARY_MODEL)
+    summary = await get_cached_summary(cache_key)
+    if summary is not None:
+        return summary if max_tokens is None else trim_to_sentence(summary, max_tokens)
+
+    # Use a faster/smaller model for summarization
+    chain = get_chain(prompts[content_type], SUMMARY_MODEL, 0.1)
     
-    response = chain.invoke({"text": text})
+    # Text longer than the summary model's context window can only be cut
+    response = await chain.ainvoke({
+        "text": truncate_to_tokens(text, context_budget(SUMMARY_MODEL)),
+        "max_words": max_words,
+    })
     
-    if hasattr(response, "content"):
-        return response.content
-    return str(response)
+    summary = response.content if hasattr(response, "content") else str(response)
+    await store_summary(cache_key, summary)
+    return summary if max_tokens is None else trim_to_sentence(summary, max_tokens)
 
-#Extract project readme files from repo to understand the project goal or purpose
-async def get_repository_readme_async(GITHUB_OWNER, GITHUB_REPO):
-    """Get the README content to understand project purpose"""
+async def find_repository_readme_github(GITHUB_OWNER, GITHUB_REPO):
+    """Find the README and return its path, blob sha, ETag and content.
+
+    Returns None when the repository has no README; API failures raise httpx.HTTPError.
+    """
     headers = {"Authorization": f"token {GITHUB_TOKEN}"}
+    # The dedicated README endpoint resolves whichever README GitHub itself would render
+    url = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}/readme"
 
-    # Try common README filenames
-    for filename in ["README.md", "README.txt", "README", "Readme.md"]:
-            url = f"https://api.github.com/repos/{GITHUB_OWNER}/{GITHUB_REPO}/contents/{filename}"
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                content = response.json().get("content", "")
-                if content:
-                    # GitHub returns content as base64 encoded
-                    import base64
-                    # print(f"Successfully retrieved redme file: {base64.b64decode(content).decode('utf-8')}")
-                    return base64.b64decode(content).decode('utf-8')
-    
-    return "No README found"
+    response = await async_http_get(url, headers=headers)
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+
+    data = response.json()
+    content = data.get("content", "")
+    if not content:
+        return None
+
+    return {
+        "path": data.get("path"),
+        "sha": data.get("sha"),
+        "etag": response.headers.get("ETag"),
+        # GitHub returns content as base64 encoded
+        "content": base64.b64decode(content).decode('utf-8'),
+    }
 
 # GitLab-specific functions
-async def get_repository_readme_gitlab(project_id):
-    """Get the README content from GitLab to understand project purpose"""
+async def find_repository_readme_gitlab(project_id):
+    """Find the README in GitLab and return its path, content SHA-256 and content.
+
+    Returns None when the project has no README; API failures raise httpx.HTTPError.
+    """
     headers = {"Authorization": f"Bearer {GITLAB_TOKEN}"}
 
-    # Try common README filenames
-    for filename in ["README.md", "README.txt", "README", "Readme.md"]:
-        url = f"https://gitlab.com/api/v4/projects/{project_id}/repository/files/{filename}/raw"
-        
-        try:
-            response = requests.get(url, headers=headers)
-            
-            if response.status_code == 200:
-                # GitLab returns the raw content directly
-                return response.text
-        except requests.exceptions.RequestException:
-            continue
-    
-    return "No README found"
\ No newline at end of file
+    # The project itself reports its README, so no filenames need probing
+    project_response = await async_http_get(f"{GITLAB_API_URL}/projects/{project_id}", headers=headers)
+    project_response.raise_for_status()
+
+    project = project_response.json()
+    readme_url = project.get("readme_url")
+    default_branch = project.get("default_branch")
+    if not readme_url or not default_branch:
+        return None
+
+    # readme_url looks like https://<host>/group/project/-/blob/<branch>/<path>
+    marker = f"/-/blob/{default_branch}/"
+    if marker not in readme_url:
+        return None
+    path = readme_url.split(marker, 1)[1]
+
+    url = f"{GITLAB_API_URL}/projects/{project_id}/repository/files/{quote(path, safe='')}/raw"
+    response = await async_http_get(url, headers=headers, params={"ref": default_branch})
+    if response.status_code == 404:
+        return None
+    response.raise_for_status()
+
+    # GitLab returns the raw content directly
+    return {
+        "path": path,
+        "ref": default_branch,
+        "content_sha256": hashlib.sha256(response.content).hexdigest(),
+        "content": response.text,
+    }